@@ -5,15 +5,39 @@
 # under the MIT license or a compatible open source license. See LICENSE.md for
 # the license text.
 
+import functools
 import json
-from typing import List, Literal
-from urllib.parse import ParseResult, urljoin, urlparse, urlunparse
+import re
+from typing import FrozenSet, List, Literal, Sequence
+from urllib.parse import SplitResult, urljoin, urlsplit, urlunsplit
 
 from ..errors import (BasedURLValidationError, URLDirectoryValidationError,
                       URLValidationError)
 
 ComfyAPIScheme = Literal['http', 'https']
 VALID_COMFY_API_SCHEMES: List[ComfyAPIScheme] = ['http', 'https']
+# Set version of the above, for membership tests.
+_VALID_COMFY_API_SCHEMES_SET: FrozenSet[str] = frozenset(
+    VALID_COMFY_API_SCHEMES)
+
+# A path segment that urljoin() leaves alone: not '.' or '..', and no ':', ';',
+# '?', '#' or '/'.
+_SIMPLE_SEGMENT = r"(?!\.\.?(?:/|$))[A-Za-z0-9._~!$&'()*+,=@%-]+"
+# A relative URL made of simple segments, e.g. 'subfolder/file.png'.
+_SIMPLE_RELATIVE_PATH_RE = re.compile(
+    f'{_SIMPLE_SEGMENT}(?:/{_SIMPLE_SEGMENT})*/?')
+# An absolute path made of simple segments, or the empty path.
+_SIMPLE_ABSOLUTE_PATH_RE = re.compile(f'(?:/{_SIMPLE_SEGMENT})*/?')
+# A directory URL with an ASCII netloc (possibly empty) and a path made of
+# simple segments, e.g. 'comfy+http://host:8188/input/' or 'file:///tmp/'.
+_SIMPLE_DIRECTORY_URL_RE = re.compile(
+    rf"[A-Za-z][A-Za-z0-9+.-]*://[A-Za-z0-9._~!$&'()*+,=@%:-]*"
+    rf'(?:/{_SIMPLE_SEGMENT})*/')
+# An http(s) URL whose netloc is a plain, non-empty ASCII host with an optional
+# port: no userinfo, brackets or anything urlsplit() would strip.
+_SIMPLE_COMFY_API_TARGET_URL_RE = re.compile(
+    r"https?://[A-Za-z0-9._~!$&'()*+,;=%-]+"
+    r"(?::[A-Za-z0-9._~!$&'()*+,;=%:-]*)?(?:[/?#]|\Z)")
 
 
 def SmartURLJoin(base: str, url: str) -> str:
@@ -23,45 +47,71 @@ def SmartURLJoin(base: str, url: str) -> str:
 
   From: https://github.com/python/cpython/issues/63028#issuecomment-1564858715
   """
-  base_pr = urlparse(base)
-  bscheme = base_pr.scheme
-
-  url_pr = urlparse(url)
-  scheme = url_pr.scheme or bscheme
+  base_sr = _CachedURLSplit(base)
+  bscheme = base_sr.scheme
+
+  if (_SIMPLE_RELATIVE_PATH_RE.fullmatch(url) is not None
+      and _SIMPLE_ABSOLUTE_PATH_RE.fullmatch(base_sr.path) is not None):
+    # Fast path for the common 'subfolder/file' case. With no dot segments,
+    # empty segments or ;params on either side, urljoin() just replaces the
+    # last segment of the base path.
+    bpath = base_sr.path
+    path = (bpath[:bpath.rfind('/') + 1] or '/') + url
+    return urlunsplit(base_sr._replace(path=path, query='', fragment=''))
+
+  url_sr = _CachedURLSplit(url)
+  scheme = url_sr.scheme or bscheme
   if bscheme != scheme:
     return url
 
-  base_pr = base_pr._replace(scheme='http')
-  url_pr = url_pr._replace(scheme='http')
+  base_sr = base_sr._replace(scheme='http')
+  if url_sr.scheme != '':
+    # Only for absolute URLs; urlunsplit() would turn a relative 'x' into
+    # 'http:///x', which then resolves against the root instead of the base.
+    url_sr = url_sr._replace(scheme='http')
 
-  joined = urljoin(urlunparse(base_pr), urlunparse(url_pr))
-  joined_pr = urlparse(joined)
-  joined_pr = joined_pr._replace(scheme=scheme)
-  return urlunparse(joined_pr)
+  joined = urljoin(urlunsplit(base_sr), urlunsplit(url_sr))
+  joined_sr = urlsplit(joined)
+  joined_sr = joined_sr._replace(scheme=scheme)
+  return urlunsplit(joined_sr)
 
 
 def JoinToBaseURL(base: str, path: str) -> str:
   """Takes a URL and appends the path to it.
   
   Always assumes the base is a directory. Always assumes the path is relative to that directory."""
-  if not base.endswith('/'):
-    base += '/'
-  if path.startswith('/'):
-    path = path[1:]
-  return base + path
+  # A single concatenation per case. Only one slash is dropped at the seam;
+  # rstrip()/lstrip() would collapse runs, turning e.g. 'file:///' into 'file:'.
+  # Single character slices are compared rather than calling endswith() and
+  # startswith(), which is cheaper in CPython.
+  if base[-1:] == '/':
+    return base + path[1:] if path[:1] == '/' else base + path
+  return base + path if path[:1] == '/' else f'{base}/{path}'
+
+
+@functools.lru_cache(maxsize=4096)
+def _CachedURLSplit(url: str) -> SplitResult:
+  # The same few API/base URLs get validated over and over again for every file
+  # transferred. SplitResult is an immutable tuple, so sharing it is safe.
+  return urlsplit(url)
 
 
 def IsValidURL(url: str) -> bool:
+  if url.isascii() and '[' not in url and ']' not in url:
+    # urlsplit() only raises for bracketed (IPv6) hosts and for non-ASCII
+    # netlocs, so there is nothing to parse for.
+    return True
   try:
-    urlparse(url)
+    _CachedURLSplit(url)
     return True
   except ValueError:
     return False
 
 
-def ToParseResult(url: str) -> ParseResult:
+def ToSplitResult(url: str) -> SplitResult:
+  """Parses the URL with urlsplit(); ;params are left as part of the path."""
   try:
-    return urlparse(url)
+    return _CachedURLSplit(url)
   except ValueError as e:
     raise URLValidationError(f'URL {json.dumps(url)} is not valid: {e}') from e
 
@@ -73,11 +123,39 @@ def ValidateIsURL(url: str) -> str:
 
 
 def IsWeaklyRelativeTo(*, base: str, url: str) -> bool:
-  url = ValidateIsURL(url=url)
-  base = ValidateIsURL(url=base)
-  base_parsed = ToParseResult(url=base)
-  joined = SmartURLJoin(base, url)
-  joined_parsed = ToParseResult(url=joined)
+  """Raises URLValidationError if either URL is invalid."""
+  return _IsWeaklyRelativeTo(base, url)
+
+
+def _IsWeaklyRelativeTo(base: str, url: str) -> bool:
+  if (url.startswith(base)
+      and _SIMPLE_DIRECTORY_URL_RE.fullmatch(base) is not None
+      and (len(url) == len(base)
+           or _SIMPLE_RELATIVE_PATH_RE.fullmatch(url, len(base)) is not None)):
+    # The common case of a URL built from the base. Simple segments appended
+    # to a simple directory URL cannot resolve outside of it, and both URLs
+    # are valid, so there is nothing to parse or join.
+    return True
+  return _CachedIsWeaklyRelativeTo(base, url)
+
+
+@functools.lru_cache(maxsize=4096)
+def _CachedIsWeaklyRelativeTo(base: str, url: str) -> bool:
+  # The same (base, url) pairs get checked over and over again, e.g. by every
+  # ValidateIsBasedURL() call for a URL, and SmartURLJoin() is not cheap.
+  # Exceptions are not cached, so invalid URLs are re-checked on every call.
+  base_parsed = ToSplitResult(url=base)
+  # Also validates the URL.
+  url_parsed = ToSplitResult(url=url)
+  if (url_parsed.scheme != '' and url_parsed.netloc != ''
+      and ';' not in url_parsed.path):
+    # SmartURLJoin() returns such URLs unchanged: as is for another scheme,
+    # and without resolving dot segments for the same one (urljoin() only
+    # resolves paths against the base when the URL has no netloc). A ';' could
+    # be dropped by urljoin()'s params round trip, so those take the long way.
+    joined_parsed = url_parsed
+  else:
+    joined_parsed = ToSplitResult(url=SmartURLJoin(base, url))
 
   if (base_parsed.scheme, base_parsed.netloc) != (joined_parsed.scheme,
                                                   joined_parsed.netloc):
@@ -86,27 +164,29 @@ def IsWeaklyRelativeTo(*, base: str, url: str) -> bool:
   return joined_parsed.path.startswith(base_parsed.path)
 
 
-def ValidateIsBasedURL(*, url: str, any_bases: List[str]) -> str:
+def ValidateIsBasedURL(*, url: str, any_bases: Sequence[str]) -> str:
   url = ValidateIsURL(url=url)
 
   for base in any_bases:
-    base = ValidateIsURL(url=base)
-    if IsWeaklyRelativeTo(base=base, url=url):
+    # Also validates the base.
+    if _IsWeaklyRelativeTo(base, url):
       return url
   raise BasedURLValidationError(
-      f'URL {json.dumps(url)} is not relative to any of {any_bases}')
+      f'URL {json.dumps(url)} is not relative to any of {list(any_bases)}')
 
 
 def Relativize(*, base: str, url: str) -> str:
   """Return the relative path from base to url, as a valid relative URL.
 
   """
-  url = ValidateIsURL(url=url)
-  base = ValidateIsURL(url=base)
-  url = ValidateIsBasedURL(url=url, any_bases=[base])
-
-  url_parsed = ToParseResult(url=url)
-  base_parsed = ToParseResult(url=base)
+  # Also validates both URLs.
+  url_parsed = ToSplitResult(url=url)
+  base_parsed = ToSplitResult(url=base)
+  # Comparing the split paths alone is not enough, e.g. 'file:///a/../b' is not
+  # under 'file:///a/'.
+  if not _IsWeaklyRelativeTo(base, url):
+    raise BasedURLValidationError(
+        f'URL {json.dumps(url)} is not relative to any of {[base]}')
 
   url_path = url_parsed.path
   base_path = base_parsed.path
@@ -118,9 +198,9 @@ def Relativize(*, base: str, url: str) -> str:
 
 
 def ValidateIsURLDirectory(url: str) -> str:
-  url = ValidateIsURL(url=url)
-  url_pr: ParseResult = ToParseResult(url=url)
-  if not url_pr.path.endswith('/'):
+  # Also validates the URL.
+  url_sr: SplitResult = ToSplitResult(url=url)
+  if url_sr.path[-1:] != '/':
     raise URLDirectoryValidationError(
         f'URL {json.dumps(url)} is not a directory, because it does not end with a trailing slash'
     )
@@ -128,12 +208,15 @@ def ValidateIsURLDirectory(url: str) -> str:
 
 
 def ValidateIsComfyAPITargetURL(url: str) -> str:
-  url_pr: ParseResult = ToParseResult(url=url)
-  if url_pr.scheme not in VALID_COMFY_API_SCHEMES:
+  if _SIMPLE_COMFY_API_TARGET_URL_RE.match(url) is not None:
+    # The scheme is valid and the hostname is non-empty, no need to split.
+    return url
+  url_sr: SplitResult = ToSplitResult(url=url)
+  if url_sr.scheme not in _VALID_COMFY_API_SCHEMES_SET:
     raise ValueError(
         f'URL {json.dumps(url)} is not a comfy API target URL, because'
         f' its scheme is not one of {VALID_COMFY_API_SCHEMES}')
-  if url_pr.hostname is None or url_pr.hostname == '':
+  if url_sr.hostname is None or url_sr.hostname == '':
     raise ValueError(
         f'URL {json.dumps(url)} is not a comfy API target URL, because'
         f' its hostname is empty')
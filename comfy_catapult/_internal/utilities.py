@@ -12,21 +12,24 @@ import datetime
 import functools
 import json
 import logging
+import os
+import stat
 import sys
 import textwrap
 import traceback
 from dataclasses import is_dataclass
 from typing import (Any, Callable, Dict, Generator, List, Literal, NamedTuple,
-                    Optional, Type, TypeVar)
+                    Optional, Type, TypeVar, Union)
 from urllib.parse import unquote as paramdecode
 from urllib.parse import urlparse
 
 import aiofiles
+import anyio.to_thread
 import pydantic_core
 import yaml
 from anyio import Path
 from pydantic import BaseModel
-from pydash import slugify
+from slugify import slugify
 
 from .url_utils import JoinToBaseURL
 
@@ -46,7 +49,14 @@ else:
                                       functools.partial(func, *args, **kwargs))
 
 
-class _CustomDumper(yaml.Dumper):
+try:
+  # The libyaml-backed dumper, if PyYAML was built with it.
+  from yaml import CDumper as _YamlDumper
+except ImportError:
+  from yaml import Dumper as _YamlDumper  # type: ignore
+
+
+class _CustomDumper(_YamlDumper):
 
   def represent_tuple(self, data):
     return self.represent_list(data)
@@ -140,6 +150,32 @@ def GetWebSocketURL(*, comfy_api_url: str, client_id: str) -> str:
   return ws_url.geturl()
 
 
+def StatRegularFileSync(path: Union[str, 'os.PathLike[str]']) -> os.stat_result:
+  """Checks that the path is an existing regular file, with a single stat().
+
+  Blocking, for code that already runs in a worker thread.
+
+  Raises:
+    ValueError: If the path does not exist or is not a regular file.
+  """
+  try:
+    st = os.stat(path)
+  except (FileNotFoundError, NotADirectoryError) as e:
+    raise ValueError(f'File {path} does not exist') from e
+  if not stat.S_ISREG(st.st_mode):
+    raise ValueError(f'File {path} is not a file')
+  return st
+
+
+async def StatRegularFile(path: Path) -> os.stat_result:
+  """Checks that the path is an existing regular file, with a single stat().
+
+  Raises:
+    ValueError: If the path does not exist or is not a regular file.
+  """
+  return await anyio.to_thread.run_sync(StatRegularFileSync, path)
+
+
 def _IsDataclassInstance(instance):
   return is_dataclass(instance) and not isinstance(instance, type)
 
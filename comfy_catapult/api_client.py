@@ -9,7 +9,8 @@ import base64
 import json
 import logging
 import textwrap
-from typing import Any, Dict, List, Optional, Type, TypeVar, Union
+from typing import (IO, Any, AsyncIterator, Dict, List, Optional, Type,
+                    TypeVar, Union)
 from urllib.parse import urlencode, urlparse
 
 import aiohttp
@@ -56,7 +57,6 @@ async def _RaiseForStatus(*,
 
     raise aiohttp.ClientResponseError(request_info=e.request_info,
                                       history=e.history,
-                                      code=e.code,
                                       status=e.status,
                                       message=message,
                                       headers=e.headers) from e
@@ -119,21 +119,38 @@ class ComfyAPIClient(ComfyAPIClientBase):
   def __init__(self,
                comfy_api_url: str,
                *,
-               errors_dump_directory: Optional[Path] = None):
+               errors_dump_directory: Optional[Path] = None,
+               session: Optional[aiohttp.ClientSession] = None):
+    """
+
+    Args:
+        comfy_api_url (str): The URL to the ComfyUI API, e.g
+          http://127.0.0.1:8188.
+        errors_dump_directory (Optional[Path], optional): Where to dump
+          responses that fail to parse. Defaults to None.
+        session (Optional[aiohttp.ClientSession], optional): A session to make
+          the requests with, so that its connections can be shared and reused.
+          The caller keeps ownership of it; it is not closed along with this
+          client. If None, the client creates and owns a new session.
+    """
     self._comfy_api_url = comfy_api_url
-    self._session = aiohttp.ClientSession()
+    self._owns_session = session is None
+    self._session = aiohttp.ClientSession() if session is None else session
     self._errors_dump_directory = errors_dump_directory
 
   async def __aenter__(self):
-    await self._session.__aenter__()
+    if self._owns_session:
+      await self._session.__aenter__()
     return self
 
   async def __aexit__(self, exc_type, exc, tb):
-    await self._session.__aexit__(exc_type, exc, tb)
+    if self._owns_session:
+      await self._session.__aexit__(exc_type, exc, tb)
     await self.Close()
 
   async def Close(self):
-    await self._session.close()
+    if self._owns_session:
+      await self._session.close()
 
   def GetURL(self) -> str:
     return self._comfy_api_url
@@ -260,7 +277,7 @@ class ComfyAPIClient(ComfyAPIClientBase):
         errors_dump_directory=self._errors_dump_directory)
 
   async def PostUploadImageRaw(self, *, folder_type: str, subfolder: str,
-                               filename: str, data: bytes,
+                               filename: str, data: Union[bytes, IO[bytes]],
                                overwrite: bool) -> dict:
     """
 
@@ -272,7 +289,8 @@ class ComfyAPIClient(ComfyAPIClientBase):
         folder_type (str): _description_
         subfolder (str): _description_
         filename (str): _description_
-        data (bytes): _description_
+        data (Union[bytes, IO[bytes]]): The file contents. A binary file object
+          is streamed from its current position rather than read into memory.
         overwrite (bool): _description_
 
     Returns:
@@ -302,7 +320,7 @@ class ComfyAPIClient(ComfyAPIClientBase):
           return result
 
   async def PostUploadImage(self, *, folder_type: str, subfolder: str,
-                            filename: str, data: bytes,
+                            filename: str, data: Union[bytes, IO[bytes]],
                             overwrite: bool) -> APIUploadImageResp:
     result = await self.PostUploadImageRaw(folder_type=folder_type,
                                            subfolder=subfolder,
@@ -325,6 +343,22 @@ class ComfyAPIClient(ComfyAPIClientBase):
         await _RaiseForStatus(resp=resp)
         return await resp.content.read()
 
+  async def StreamView(self,
+                       *,
+                       folder_type: str,
+                       subfolder: str,
+                       filename: str,
+                       chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+    data = {'filename': filename, 'subfolder': subfolder, 'type': folder_type}
+    url = urlparse(JoinToBaseURL(self._comfy_api_url, 'view'))
+    url = url._replace(query=urlencode(data))
+
+    async with WatchVar(url=url.geturl()):
+      async with self._session.get(url.geturl()) as resp:
+        await _RaiseForStatus(resp=resp)
+        async for chunk in resp.content.iter_chunked(chunk_size):
+          yield chunk
+
   async def PostFree(self, *, unload_models: bool, free_memory: bool):
     data = {'unload_models': unload_models, 'free_memory': free_memory}
     url = urlparse(JoinToBaseURL(self._comfy_api_url, 'free'))
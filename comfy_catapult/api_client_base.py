@@ -6,7 +6,7 @@
 # the license text.
 
 from abc import ABC, abstractmethod
-from typing import List, Optional
+from typing import IO, AsyncIterator, List, Optional, Union
 
 from .comfy_schema import (APIHistory, APIObjectInfo, APIPromptInfo,
                            APIQueueInfo, APISystemStats, APIUploadImageResp,
@@ -170,15 +170,32 @@ class ComfyAPIClientBase(ABC):
                     filename: str) -> bytes:
     raise NotImplementedError()
 
+  async def StreamView(self,
+                       *,
+                       folder_type: str,
+                       subfolder: str,
+                       filename: str,
+                       chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+    """Like GetView(), but yields the file in chunks as they arrive.
+
+    The default implementation downloads the whole file with GetView(), and then
+    yields it in chunks. Subclasses can override it to actually stream.
+    """
+    data = await self.GetView(folder_type=folder_type,
+                              subfolder=subfolder,
+                              filename=filename)
+    for offset in range(0, len(data), chunk_size):
+      yield data[offset:offset + chunk_size]
+
   @abstractmethod
   async def PostUploadImageRaw(self, *, folder_type: str, subfolder: str,
-                               filename: str, data: bytes,
+                               filename: str, data: Union[bytes, IO[bytes]],
                                overwrite: bool) -> dict:
     raise NotImplementedError()
 
   @abstractmethod
   async def PostUploadImage(self, *, folder_type: str, subfolder: str,
-                            filename: str, data: bytes,
+                            filename: str, data: Union[bytes, IO[bytes]],
                             overwrite: bool) -> APIUploadImageResp:
     raise NotImplementedError()
 
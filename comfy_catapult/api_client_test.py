@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: MIT
+#
+# The Comfy Catapult project requires contributions made to this file be licensed
+# under the MIT license or a compatible open source license. See LICENSE.md for
+# the license text.
+
+import unittest
+from typing import List
+from unittest import IsolatedAsyncioTestCase
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from .api_client import ComfyAPIClient
+from .api_client_base import ComfyAPIClientBase
+
+_CONTENTS = bytes(range(256)) * 1000
+
+
+async def _View(request: web.Request) -> web.Response:
+  if (request.query.get('type') != 'output'
+      or request.query.get('subfolder') != 'sub'
+      or request.query.get('filename') != 'a.png'):
+    return web.Response(status=404, text='Not found')
+  return web.Response(body=_CONTENTS)
+
+
+class TestApiClient(IsolatedAsyncioTestCase):
+
+  async def asyncSetUp(self):
+    app = web.Application()
+    app.router.add_get('/view', _View)
+    self._server = TestServer(app)
+    await self._server.start_server()
+    self.addAsyncCleanup(self._server.close)
+    comfy_api_url = str(self._server.make_url('/'))
+    self._client = ComfyAPIClient(comfy_api_url)
+    self.addAsyncCleanup(self._client.Close)
+
+  async def test_StreamView(self):
+    chunks: List[bytes] = [
+        chunk async for chunk in self._client.StreamView(
+            folder_type='output',
+            subfolder='sub',
+            filename='a.png',
+            chunk_size=4096)
+    ]
+    self.assertEqual(b''.join(chunks), _CONTENTS)
+    self.assertGreater(len(chunks), 1)
+    self.assertTrue(all(len(chunk) <= 4096 for chunk in chunks))
+
+  async def test_StreamViewDefault(self):
+    # The base class's StreamView(), for clients that only implement GetView().
+    chunks: List[bytes] = [
+        chunk async for chunk in ComfyAPIClientBase.StreamView(
+            self._client,
+            folder_type='output',
+            subfolder='sub',
+            filename='a.png',
+            chunk_size=4096)
+    ]
+    self.assertEqual(b''.join(chunks), _CONTENTS)
+    self.assertEqual(len(chunks), -(-len(_CONTENTS) // 4096))
+    self.assertTrue(all(len(chunk) <= 4096 for chunk in chunks))
+
+  async def test_StreamViewNotFound(self):
+    with self.assertRaises(aiohttp.ClientResponseError) as cm:
+      async for _ in self._client.StreamView(folder_type='output',
+                                             subfolder='sub',
+                                             filename='missing.png'):
+        self.fail('Expected no chunks')
+    self.assertEqual(cm.exception.status, 404)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -294,7 +294,7 @@ class ComfyCatapult(ComfyCatapultBase):
             f'Errors in workflow'
             f'\nprepared_workflow:\n{textwrap.indent(prepared_workflow_yaml_str, prefix="  ")}'
             f'\nticket:\n{textwrap.indent(ticket_yaml_str, prefix="  ")}',
-            prepared_workflow=deepcopy(prepared_workflow),
+            prepared_workflow=prepared_workflow,
             ticket=ticket)
 
       if ticket.prompt_id is None:
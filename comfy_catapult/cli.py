@@ -87,7 +87,7 @@ async def GetRemote(*, comfy_api_url: str):
   remote.Register(
       ComfySchemeRemoteFileAPI(comfy_api_urls=[comfy_api_url], overwrite=True))
   # if args.comfy_install_file_url is not None:
-  #   scheme = ToParseResult(args.comfy_install_file_url).scheme
+  #   scheme = ToSplitResult(args.comfy_install_file_url).scheme
   #   if scheme != 'file':
   #     raise ValueError(
   #         f'args.comfy_install_file_url must be a file:// URL, but is {args.comfy_install_file_url}'
@@ -5,11 +5,13 @@
 # under the MIT license or a compatible open source license. See LICENSE.md for
 # the license text.
 
+import functools
 import json
+import re
 from typing import Any, Dict, List, Literal, NamedTuple, Optional, Union
 from urllib.parse import urljoin
 
-from pydantic import BaseModel, ConfigDict, Field, RootModel, field_validator
+from pydantic import BaseModel, ConfigDict, Field, RootModel, model_validator
 from typing_extensions import Annotated
 
 EXTRA: Union[Literal['allow', 'ignore', 'forbid'], None] = 'allow'
@@ -54,6 +56,13 @@ ComboInputType = Annotated[List[Any], Field(alias='combo_input_class')]
 ComfyFolderType = Literal['input', 'output', 'temp']
 VALID_FOLDER_TYPES: List[ComfyFolderType] = ['input', 'output', 'temp']
 
+# Path segments that urljoin() leaves alone: not '.' or '..', and no ':', ';',
+# '?', '#' or '/'.
+_PLAIN_SEGMENT = r"[A-Za-z0-9._~!$&'()*+,=@%-]+"
+# E.g. 'subfolder/subsubfolder/', or ''.
+_PLAIN_DIR_RE = re.compile(rf'(?:(?!\.\.?/){_PLAIN_SEGMENT}/)*')
+_PLAIN_FILENAME_RE = re.compile(rf'(?!\.\.?$){_PLAIN_SEGMENT}')
+
 
 ################################################################################
 class APIWorkflowInConnection(NamedTuple):
@@ -560,40 +569,47 @@ class ComfyUIPathTriplet(BaseModel):
   subfolder: str
   filename: str
 
-  @field_validator('type')
-  @classmethod
-  def validate_folder_type(cls, v: str):
-    if v not in VALID_FOLDER_TYPES:
+  @model_validator(mode='after')
+  def validate_triplet(self) -> 'ComfyUIPathTriplet':
+    # A single validator, rather than one per field, to save the per-field
+    # callbacks. `type` is already checked by its Literal annotation.
+    if self.subfolder[:1] == '/':
+      raise ValueError(
+          f'subfolder {json.dumps(self.subfolder)} must not start with a slash')
+    if '/' in self.filename:
+      raise ValueError(
+          f'filename {json.dumps(self.filename)} must not contain a slash')
+    if self.filename == '':
       raise ValueError(
-          f'folder_type {json.dumps(v)} is not one of {VALID_FOLDER_TYPES}')
-    return v
-
-  @field_validator('subfolder')
-  @classmethod
-  def validate_subfolder(cls, v: str):
-    if v.startswith('/'):
-      raise ValueError(f'subfolder {json.dumps(v)} must not start with a slash')
-    return v
-
-  @field_validator('filename')
-  @classmethod
-  def validate_filename(cls, v: str):
-    if '/' in v:
-      raise ValueError(f'filename {json.dumps(v)} must not contain a slash')
-    if v == '':
-      raise ValueError(f'filename {json.dumps(v)} must not be empty')
-    return v
+          f'filename {json.dumps(self.filename)} must not be empty')
+    return self
 
   def ToLocalPathStr(self, *, include_folder_type: bool) -> str:
     """Converts this triplet to something like `input/subfolder/filename`.
     """
-    subfolder = self.subfolder
-    if subfolder == '':
-      subfolder = '.'
-    if not subfolder.endswith('/'):
-      subfolder += '/'
-
-    local_path = urljoin(subfolder, self.filename)
+    return _TripletToLocalPathStr(self.type, self.subfolder, self.filename,
+                                  include_folder_type)
+
+
+@functools.lru_cache(maxsize=4096)
+def _TripletToLocalPathStr(folder_type: str, subfolder: str, filename: str,
+                           include_folder_type: bool) -> str:
+  # Keyed on the field values rather than cached on the (frozen) instance, so
+  # that equal triplets share entries and the model's __dict__, which pydantic
+  # uses for equality and hashing, is left alone.
+  if subfolder != '' and subfolder[-1:] != '/':
+    subfolder += '/'
+
+  if (_PLAIN_DIR_RE.fullmatch(subfolder) is not None
+      and _PLAIN_FILENAME_RE.fullmatch(filename) is not None):
+    # Nothing for urljoin() to resolve, so plain concatenation gives the same
+    # result.
+    local_path = subfolder + filename
     if include_folder_type:
-      local_path = urljoin(f'{self.type}/', local_path)
+      local_path = f'{folder_type}/{local_path}'
     return local_path
+
+  local_path = urljoin(subfolder or './', filename)
+  if include_folder_type:
+    local_path = urljoin(f'{folder_type}/', local_path)
+  return local_path
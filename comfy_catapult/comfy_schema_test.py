@@ -116,6 +116,32 @@ class TestComfySchema(IsolatedAsyncioTestCase):
                                          subfolder=subfolder,
                                          filename='remote-file.txt')
 
+  def test_ComfyUIPathTripletToLocalPathStr(self):
+    # Dot segments are resolved, like urljoin() does.
+    expected_local_paths = {
+        '': 'remote-file.txt',
+        'subfolder': 'subfolder/remote-file.txt',
+        './subfolder': 'subfolder/remote-file.txt',
+        'subfolder/': 'subfolder/remote-file.txt',
+        'subfolder/subsubfolder/': 'subfolder/subsubfolder/remote-file.txt',
+        'subfolder/subsubfolder': 'subfolder/subsubfolder/remote-file.txt',
+        'subfolder/./subsubfolder': 'subfolder/subsubfolder/remote-file.txt',
+        'subfolder/../subsubfolder': 'subsubfolder/remote-file.txt',
+    }
+    self.assertEqual(set(expected_local_paths),
+                     {subfolder for subfolder, _ in VALID_SUBFOLDER_EDGES})
+
+    for folder_type in VALID_FOLDER_TYPES:
+      for subfolder, expected in expected_local_paths.items():
+        with self.subTest(folder_type=folder_type, subfolder=subfolder):
+          triplet = ComfyUIPathTriplet(type=folder_type,
+                                       subfolder=subfolder,
+                                       filename='remote-file.txt')
+          self.assertEqual(triplet.ToLocalPathStr(include_folder_type=False),
+                           expected)
+          self.assertEqual(triplet.ToLocalPathStr(include_folder_type=True),
+                           f'{folder_type}/{expected}')
+
 
 if __name__ == '__main__':
   unittest.main()
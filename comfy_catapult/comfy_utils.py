@@ -6,10 +6,10 @@
 # the license text.
 
 import logging
-from typing import (Generator, Hashable, List, Literal, NamedTuple, Optional,
-                    Union, cast)
+import re
+from typing import (Any, Dict, Generator, Hashable, List, Literal, NamedTuple,
+                    Optional, Tuple, Union, cast)
 
-import pydash
 from anyio import Path
 
 from .comfy_schema import (APIHistoryEntry, APINodeID, APIOutputUI,
@@ -26,104 +26,231 @@ class NodeIDAndNode(NamedTuple):
   node_info: APIWorkflowNodeInfo
 
 
-def FindNodesByTitle(*, workflow: APIWorkflow,
-                     title: str) -> Generator[NodeIDAndNode, None, None]:
+TitleIndex = Dict[str, List[APINodeID]]
+"""Maps a node title to the ids of all the nodes with that title."""
+
+
+def BuildTitleIndex(*, workflow: APIWorkflow) -> TitleIndex:
+  """Builds a title => node ids index in a single pass over the workflow.
+
+  Pass the result as `title_index` to the *ByTitle functions when doing several
+  lookups on the same workflow. The index is a snapshot; rebuild it if nodes are
+  added, removed or retitled.
+  """
+  title_index: TitleIndex = {}
+  node_id: APINodeID
+  node_info: APIWorkflowNodeInfo
+  for node_id, node_info in workflow.root.items():
+    if node_info.meta is not None and node_info.meta.title is not None:
+      title_index.setdefault(node_info.meta.title, []).append(node_id)
+  return title_index
+
+
+def FindNodesByTitle(
+    *,
+    workflow: APIWorkflow,
+    title: str,
+    title_index: Optional[TitleIndex] = None
+) -> Generator[NodeIDAndNode, None, None]:
   node_id: APINodeID
   node_info: APIWorkflowNodeInfo
+  if title_index is not None:
+    for node_id in title_index.get(title, ()):
+      yield NodeIDAndNode(node_id=node_id, node_info=workflow.root[node_id])
+    return
   for node_id, node_info in workflow.root.items():
     if node_info.meta is not None and node_info.meta.title == title:
       yield NodeIDAndNode(node_id=node_id, node_info=node_info)
 
 
-def FindNodeByTitle(*, workflow: APIWorkflow,
-                    title: str) -> Optional[NodeIDAndNode]:
-  for (node_id, node_info) in FindNodesByTitle(workflow=workflow, title=title):
+def FindNodeByTitle(
+    *,
+    workflow: APIWorkflow,
+    title: str,
+    title_index: Optional[TitleIndex] = None) -> Optional[NodeIDAndNode]:
+  for (node_id, node_info) in FindNodesByTitle(workflow=workflow,
+                                               title=title,
+                                               title_index=title_index):
     return NodeIDAndNode(node_id=node_id, node_info=node_info)
   return None
 
 
-def GetNodeByTitle(*, workflow: APIWorkflow, title: str) -> NodeIDAndNode:
-  nodes: List[NodeIDAndNode] = list(
-      FindNodesByTitle(workflow=workflow, title=title))
-
-  if len(nodes) == 0:
+def GetNodeByTitle(*,
+                   workflow: APIWorkflow,
+                   title: str,
+                   title_index: Optional[TitleIndex] = None) -> NodeIDAndNode:
+  nodes = FindNodesByTitle(workflow=workflow,
+                           title=title,
+                           title_index=title_index)
+  # Only pull as many matches as needed to tell 0, 1 and "more than 1" apart.
+  first: Optional[NodeIDAndNode] = next(nodes, None)
+  if first is None:
     raise NodeNotFound(title=title, node_id=None)
 
-  if len(nodes) > 1:
-    raise MultipleNodesFound(search_titles=[title],
-                             search_nodes=[title],
-                             found_titles=[],
-                             found_nodes=[node_id for node_id, _ in nodes])
-  node_id, node_info = nodes[0]
-
-  return NodeIDAndNode(node_id=node_id, node_info=node_info)
-
-
-def FindNode(*, workflow: APIWorkflow,
-             id_or_title: Union[int, str]) -> Optional[NodeIDAndNode]:
-  id_node_id: Optional[APINodeID] = None
-  # id_node_error: Optional[Exception] = None
-
-  title_node_id: Optional[APINodeID] = None
-  # title_node_error: Optional[Exception] = None
+  second: Optional[NodeIDAndNode] = next(nodes, None)
+  if second is not None:
+    raise MultipleNodesFound(
+        search_titles=[title],
+        search_nodes=[title],
+        found_titles=[],
+        found_nodes=[first.node_id, second.node_id] +
+        [node_id for node_id, _ in nodes])
 
-  try:
-    if isinstance(id_or_title, str):
-      title_node_id, _ = GetNodeByTitle(workflow=workflow, title=id_or_title)
+  return first
 
-  except NodeNotFound:
-    # id_node_error = e
-    pass
 
+def FindNode(
+    *,
+    workflow: APIWorkflow,
+    id_or_title: Union[int, str],
+    title_index: Optional[TitleIndex] = None) -> Optional[NodeIDAndNode]:
   id_or_title_str = str(id_or_title)
-  try:
-    id_node_id_: APINodeID = cast(APINodeID, id_or_title_str)
-    if id_node_id_ in workflow.root:
-      id_node_id = id_node_id_
-  except ValueError:
-    # title_node_error = e
-    pass
-
-  if title_node_id is None and id_node_id is None:
-    return None
-  elif title_node_id is not None and id_node_id is not None:
+  # Node ids are always strings, so an int can only ever match by id.
+  title_nodes: List[NodeIDAndNode] = []
+  if isinstance(id_or_title, str):
+    title_nodes = list(
+        FindNodesByTitle(workflow=workflow,
+                         title=id_or_title,
+                         title_index=title_index))
+  if len(title_nodes) > 1:
+    raise MultipleNodesFound(
+        search_titles=[id_or_title_str],
+        search_nodes=[id_or_title_str],
+        found_titles=[],
+        found_nodes=[node_id for node_id, _ in title_nodes])
+
+  id_node_info = workflow.root.get(id_or_title_str)
+  if not title_nodes:
+    if id_node_info is None:
+      return None
+    return NodeIDAndNode(node_id=id_or_title_str, node_info=id_node_info)
+  if id_node_info is not None:
     raise MultipleNodesFound(search_titles=[id_or_title_str],
-                             search_nodes=[id_node_id],
-                             found_titles=[title_node_id],
-                             found_nodes=[id_node_id])
-  elif title_node_id is not None:
-    return NodeIDAndNode(node_id=title_node_id,
-                         node_info=workflow.root[title_node_id])
-  else:
-    if id_node_id is None:
-      raise AssertionError('id_node_id is None')
-
-    return NodeIDAndNode(node_id=id_node_id,
-                         node_info=workflow.root[id_node_id])
-
-
-def GetNode(*, workflow: APIWorkflow, id_or_title: Union[str,
-                                                         int]) -> NodeIDAndNode:
-  node = FindNode(workflow=workflow, id_or_title=id_or_title)
+                             search_nodes=[id_or_title_str],
+                             found_titles=[title_nodes[0].node_id],
+                             found_nodes=[id_or_title_str])
+  return title_nodes[0]
+
+
+def GetNode(
+    *,
+    workflow: APIWorkflow,
+    id_or_title: Union[str, int],
+    title_index: Optional[TitleIndex] = None) -> NodeIDAndNode:
+  node = FindNode(workflow=workflow,
+                  id_or_title=id_or_title,
+                  title_index=title_index)
   if node is None:
     raise NodeNotFound(title=id_or_title, node_id=id_or_title)
   return node
 
 
+# Matches everything that int() accepts, and a little more, so that keys that
+# are clearly not integers can be skipped without raising a ValueError.
+_INT_LITERAL_RE = re.compile(r'\s*[+-]?\d+(?:_\d+)*\s*')
+
+
 def GenerateNewNodeID(*, workflow: APIWorkflow) -> APINodeID:
-  all_keys = workflow.root.keys()
-  max_integer = 0
+  """Returns one more than the largest integer node id in the workflow.
 
-  # Filter all keys that fail to convert to int
-  for key in all_keys:
+  A key counts as an integer if int() accepts it, e.g ' 7' or '+3'.
+  """
+  max_integer = 0
+  for key in workflow.root.keys():
+    # Most keys are plain decimal numbers. Anything else only reaches int() if
+    # it looks like an integer literal, so e.g a title never raises.
+    if not key.isdecimal() and _INT_LITERAL_RE.fullmatch(key) is None:
+      continue
     try:
       max_integer = max(int(key), max_integer)
     except ValueError:
       continue
-
   return cast(APINodeID, str(max_integer + 1))
 
 
+# Matches one step of a field path: `[0]`, `key` or a `.` separator.
+_FIELD_PATH_TOKEN_RE = re.compile(r'\[(-?\d+)\]|([^.\[\]]+)|\.')
+_COMPILED_FIELD_PATHS: Dict[str, Tuple[Hashable, ...]] = {}
+
+
+def _CompileFieldPath(
+    field_path: Union[Hashable, List[Hashable]]) -> Tuple[Hashable, ...]:
+  """Turns e.g `'images[0]'` into `('images', 0)`.
+
+  String paths are parsed once and cached. A list is taken as the steps
+  themselves, and any other hashable as a single key.
+  """
+  if isinstance(field_path, list):
+    return tuple(field_path)
+  if not isinstance(field_path, str):
+    return (field_path, )
+
+  steps = _COMPILED_FIELD_PATHS.get(field_path)
+  if steps is not None:
+    return steps
+
+  steps_list: List[Hashable] = []
+  pos = 0
+  while pos < len(field_path):
+    m = _FIELD_PATH_TOKEN_RE.match(field_path, pos)
+    if m is None:
+      raise ValueError(f'Invalid field path {repr(field_path)} at {pos}')
+    index, key = m.groups()
+    if index is not None:
+      steps_list.append(int(index))
+    elif key is not None:
+      steps_list.append(key)
+    pos = m.end()
+
+  steps = tuple(steps_list)
+  _COMPILED_FIELD_PATHS[field_path] = steps
+  return steps
+
+
+def _GetFieldPath(obj: Any, field_path: Union[Hashable,
+                                              List[Hashable]]) -> Any:
+  for step in _CompileFieldPath(field_path):
+    try:
+      if isinstance(obj, list) and isinstance(step, str):
+        # Like pydash.get(), e.g 'images.0' indexes the list as well.
+        step = int(step)
+      obj = obj[step]
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+      raise Exception(
+          f'Field path {repr(field_path)} not found, failed at {repr(step)}'
+      ) from e
+  return obj
+
+
+def _GetPreviewImageTriplet(
+    *, node_id: APINodeID, job_history: APIHistoryEntry,
+    field_path: Union[Hashable, List[Hashable]]) -> ComfyUIPathTriplet:
+  if job_history.outputs is None:
+    raise AssertionError('job_history.outputs is None')
+
+  if node_id not in job_history.outputs:
+    raise Exception(f'{node_id} not in job_history.outputs')
+
+  node_outputs: APIOutputUI = job_history.outputs[node_id]
+
+  file_dict: Any = _GetFieldPath(node_outputs.root, field_path)
+  if not isinstance(file_dict, dict):
+    raise Exception(f'Expected a dict at {repr(field_path)}, got {file_dict}')
+
+  filename = file_dict.get('filename')
+  subfolder = file_dict.get('subfolder')
+  folder_type = file_dict.get('type')
+  if (not isinstance(filename, str) or not isinstance(subfolder, str)
+      or folder_type not in ('temp', 'output')):
+    raise Exception(
+        'Expected "filename" and "subfolder" to be str, and "type" to be'
+        f' "temp" or "output", got {file_dict}')
+
+  return ComfyUIPathTriplet(type=cast(Literal['temp', 'output'], folder_type),
+                            subfolder=subfolder,
+                            filename=filename)
+
+
 async def DownloadPreviewImage(*, node_id: APINodeID,
                                job_history: APIHistoryEntry,
                                field_path: Union[Hashable, List[Hashable]],
@@ -167,45 +294,42 @@ async def DownloadPreviewImage(*, node_id: APINodeID,
   Args:
       node_id: The node_id.
       job_history: The job_history.
-      field_path: A pydash field path, for the pydash.get() and pydash.set_()
-        functions.
+      field_path: A field path into the node's outputs, e.g 'images[0]', or a
+        list of keys/indices, e.g ['images', 0].
       comfy_api_url: e.g http://127.0.0.1:8188.
       remote: A RemoteFileAPI instance.
       local_dst_path: Path to the local destination file.
   """
 
-  if job_history.outputs is None:
-    raise AssertionError('job_history.outputs is None')
-
-  if node_id not in job_history.outputs:
-    raise Exception(f'{node_id} not in job_history.outputs')
-
-  node_outputs: APIOutputUI = job_history.outputs[node_id]
-
-  file_dict: dict = pydash.get(node_outputs.root, field_path)
-
-  if 'filename' not in file_dict:
-    raise Exception(f'Expected "filename" in {file_dict}')
-  filename: str = file_dict['filename']
-  if not isinstance(filename, str):
-    raise Exception(f'Expected "filename" to be str, got {type(filename)}')
-  if 'subfolder' not in file_dict:
-    raise Exception(f'Expected "subfolder" in {file_dict}')
-  subfolder: str = file_dict['subfolder']
-  if not isinstance(subfolder, str):
-    raise Exception(f'Expected "subfolder" to be str, got {type(subfolder)}')
-  if 'type' not in file_dict:
-    raise Exception(f'Expected "type" in {file_dict}')
-  folder_type: Literal['temp', 'output'] = file_dict['type']
-  if not isinstance(folder_type, str):
-    raise Exception(f'Expected "type" to be str, got {type(folder_type)}')
-  if folder_type not in ['temp', 'output']:
-    raise Exception(
-        f'Expected "type" to be "temp" or "output", got {folder_type}')
-
-  triplet = ComfyUIPathTriplet(type=folder_type,
-                               subfolder=subfolder,
-                               filename=filename)
+  triplet = _GetPreviewImageTriplet(node_id=node_id,
+                                    job_history=job_history,
+                                    field_path=field_path)
   return await remote.DownloadTriplet(untrusted_comfy_api_url=comfy_api_url,
                                       untrusted_src_triplet=triplet,
                                       dst_path=local_dst_path)
+
+
+async def DownloadPreviewImages(*, node_ids: List[APINodeID],
+                                job_history: APIHistoryEntry,
+                                field_paths: List[Union[Hashable,
+                                                        List[Hashable]]],
+                                comfy_api_url: str, remote: RemoteFileAPIBase,
+                                local_dst_paths: List[Path]):
+  """Same as DownloadPreviewImage(), but downloads several outputs concurrently.
+
+  node_ids, field_paths and local_dst_paths are parallel lists, see
+  DownloadPreviewImage() for the meaning of each.
+  """
+  if not len(node_ids) == len(field_paths) == len(local_dst_paths):
+    raise ValueError(
+        'node_ids, field_paths and local_dst_paths must be the same length,'
+        f' got {len(node_ids)}, {len(field_paths)}, {len(local_dst_paths)}')
+  triplets = [
+      _GetPreviewImageTriplet(node_id=node_id,
+                              job_history=job_history,
+                              field_path=field_path)
+      for node_id, field_path in zip(node_ids, field_paths)
+  ]
+  await remote.DownloadTripletsBatch(untrusted_comfy_api_url=comfy_api_url,
+                                     untrusted_src_triplets=triplets,
+                                     dst_paths=local_dst_paths)
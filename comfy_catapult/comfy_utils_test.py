@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: MIT
+#
+# The Comfy Catapult project requires contributions made to this file be licensed
+# under the MIT license or a compatible open source license. See LICENSE.md for
+# the license text.
+
+import asyncio
+import sys
+import unittest
+from typing import Any, List, Optional, Tuple
+
+from anyio import Path
+
+from .comfy_schema import (APIHistoryEntry, APIWorkflow, APIWorkflowNodeInfo,
+                           ComfyUIPathTriplet)
+from .comfy_utils import (BuildTitleIndex, DownloadPreviewImages,
+                          FindNodesByTitle, GenerateNewNodeID,
+                          _CompileFieldPath, _GetFieldPath)
+from .remote_file_api_base import RemoteFileAPIBase
+
+
+def _MakeWorkflow(node_ids: List[str]) -> APIWorkflow:
+  return APIWorkflow.model_validate({
+      node_id: {
+          'class_type': 'PreviewImage',
+          'inputs': {}
+      }
+      for node_id in node_ids
+  })
+
+
+def _MakeNode() -> APIWorkflowNodeInfo:
+  return APIWorkflowNodeInfo(class_type='PreviewImage', inputs={}, _meta=None)
+
+
+class _RecordingRemoteFileAPI(RemoteFileAPIBase):
+  """Records the triplets it is asked to download."""
+
+  def __init__(self):
+    super().__init__()
+    self.downloads: List[Tuple[str, ComfyUIPathTriplet, Path]] = []
+
+  async def UploadFile(self, *, src_path: Path, untrusted_dst_url: str) -> str:
+    raise NotImplementedError()
+
+  async def DownloadFile(self, *, untrusted_src_url: str, dst_path: Path):
+    raise NotImplementedError()
+
+  async def DownloadTriplet(self, *, untrusted_comfy_api_url: str,
+                            untrusted_src_triplet: ComfyUIPathTriplet,
+                            dst_path: Path):
+    self.downloads.append(
+        (untrusted_comfy_api_url, untrusted_src_triplet, dst_path))
+
+  def TripletToURL(self, *, comfy_api_url: str,
+                   triplet: ComfyUIPathTriplet) -> str:
+    raise NotImplementedError()
+
+  def URLToTriplet(self, *, url: str) -> Tuple[str, ComfyUIPathTriplet]:
+    raise NotImplementedError()
+
+  def GetBases(self) -> List[str]:
+    return []
+
+
+class TestComfyUtils(unittest.TestCase):
+
+  def test_GenerateNewNodeID(self):
+    self.assertEqual(GenerateNewNodeID(workflow=_MakeWorkflow([])), '1')
+    self.assertEqual(GenerateNewNodeID(workflow=_MakeWorkflow(['1', '2'])),
+                     '3')
+    self.assertEqual(
+        GenerateNewNodeID(workflow=_MakeWorkflow(['10', '2', 'title', '-3'])),
+        '11')
+    # Anything that int() accepts counts.
+    self.assertEqual(
+        GenerateNewNodeID(workflow=_MakeWorkflow(['2', ' 7', '+3'])), '8')
+
+  def test_GenerateNewNodeIDAfterEdits(self):
+    workflow = _MakeWorkflow(['1', '2'])
+    self.assertEqual(GenerateNewNodeID(workflow=workflow), '3')
+    workflow.root['3'] = _MakeNode()
+    workflow.root['4'] = _MakeNode()
+    del workflow.root['1']
+    # Same number of nodes as after inserting just '3', but '4' is taken.
+    self.assertEqual(GenerateNewNodeID(workflow=workflow), '5')
+
+    workflow.root['10'] = _MakeNode()
+    workflow.root['5'] = _MakeNode()
+    del workflow.root['2']
+    self.assertEqual(GenerateNewNodeID(workflow=workflow), '11')
+
+    # Insert nodes one after the other, as a caller building a workflow would.
+    for _ in range(5):
+      node_id = GenerateNewNodeID(workflow=workflow)
+      self.assertNotIn(node_id, workflow.root)
+      workflow.root[node_id] = _MakeNode()
+    self.assertEqual(sorted(workflow.root.keys(), key=int),
+                     ['3', '4', '5', '10', '11', '12', '13', '14', '15'])
+
+  def test_GenerateNewNodeIDMatchesInt(self):
+
+    def _IntOrNone(key: str) -> Optional[int]:
+      try:
+        return int(key)
+      except ValueError:
+        return None
+
+    # Every character that int() might accept, alone, around and within a
+    # number.
+    chars = [
+        chr(c) for c in range(sys.maxunicode + 1)
+        if chr(c).isspace() or chr(c).isnumeric()
+    ] + ['+', '-', '_', 'x', '.', 'a']
+    keys = ['', 'title', '12:34', '0x10', '1__0', '_1', '1_', '+-1'] + [
+        key for c in chars for key in (c, f'{c}7', f'7{c}', f'1{c}0')
+    ]
+    for key in keys:
+      value = _IntOrNone(key)
+      expected = str(max(0 if value is None else value, 0) + 1)
+      with self.subTest(key=key):
+        self.assertEqual(GenerateNewNodeID(workflow=_MakeWorkflow([key])),
+                         expected)
+
+  def test_BuildTitleIndex(self):
+    workflow = APIWorkflow.model_validate({
+        '1': {
+            'class_type': 'PreviewImage',
+            'inputs': {},
+            '_meta': {
+                'title': 'Preview'
+            }
+        },
+        '2': {
+            'class_type': 'PreviewImage',
+            'inputs': {}
+        },
+        '3': {
+            'class_type': 'SaveImage',
+            'inputs': {},
+            '_meta': {
+                'title': 'Save'
+            }
+        },
+        '4': {
+            'class_type': 'PreviewImage',
+            'inputs': {},
+            '_meta': {
+                'title': 'Preview'
+            }
+        },
+    })
+    title_index = BuildTitleIndex(workflow=workflow)
+    self.assertEqual(title_index, {'Preview': ['1', '4'], 'Save': ['3']})
+    for title in ['Preview', 'Save', 'Missing']:
+      with self.subTest(title=title):
+        self.assertEqual(
+            list(
+                FindNodesByTitle(workflow=workflow,
+                                 title=title,
+                                 title_index=title_index)),
+            list(FindNodesByTitle(workflow=workflow, title=title)))
+
+  def test_CompileFieldPath(self):
+    self.assertEqual(_CompileFieldPath('images[0]'), ('images', 0))
+    self.assertEqual(_CompileFieldPath('images[-1]'), ('images', -1))
+    self.assertEqual(_CompileFieldPath('a.b[2][3].c'), ('a', 'b', 2, 3, 'c'))
+    self.assertEqual(_CompileFieldPath('gifs'), ('gifs', ))
+    self.assertEqual(_CompileFieldPath(['images', 0]), ('images', 0))
+    self.assertEqual(_CompileFieldPath(3), (3, ))
+    # Cached, so the second call returns the same tuple.
+    self.assertIs(_CompileFieldPath('images[0]'),
+                  _CompileFieldPath('images[0]'))
+    for field_path in ['images[', 'images[x]', 'images]']:
+      with self.subTest(field_path=field_path):
+        with self.assertRaises(ValueError):
+          _CompileFieldPath(field_path)
+
+  def test_GetFieldPath(self):
+    images = [{'filename': 'a.png'}, {'filename': 'b.png'}]
+    obj = {'images': images, 'a': {'b': [[1, 2], [3, 4]]}}
+    # What pydash.get() returned for these, before it was replaced.
+    expected: List[Tuple[Any, Any]] = [
+        ('images[0]', images[0]),
+        ('images[-1]', images[1]),
+        ('images.1', images[1]),
+        ('images.-2', images[0]),
+        ('images[1].filename', 'b.png'),
+        ('a.b[1][-1]', 4),
+        ('a.b.0.1', 2),
+        (['images', -1], images[1]),
+        ('images', images),
+    ]
+    for field_path, value in expected:
+      with self.subTest(field_path=field_path):
+        self.assertEqual(_GetFieldPath(obj, field_path), value)
+    # pydash.get() returned None for these, which then failed further on.
+    for field_path in [
+        'images[2]', 'images[-3]', 'gifs', 'images.x', 'a.b[0].c'
+    ]:
+      with self.subTest(field_path=field_path):
+        with self.assertRaises(Exception):
+          _GetFieldPath(obj, field_path)
+
+  def test_DownloadPreviewImages(self):
+    job_history = APIHistoryEntry.model_validate({
+        'outputs': {
+            '9': {
+                'images': [{
+                    'filename': 'a.png',
+                    'subfolder': '',
+                    'type': 'output'
+                }, {
+                    'filename': 'b.png',
+                    'subfolder': 'sub',
+                    'type': 'output'
+                }]
+            },
+            '25': {
+                'gifs': [{
+                    'filename': 'c.gif',
+                    'subfolder': '',
+                    'type': 'temp'
+                }]
+            },
+        }
+    })
+    remote = _RecordingRemoteFileAPI()
+    dst_paths = [Path('/dst/b.png'), Path('/dst/c.gif'), Path('/dst/a.png')]
+    asyncio.run(
+        DownloadPreviewImages(node_ids=['9', '25', '9'],
+                              job_history=job_history,
+                              field_paths=['images[1]', 'gifs[0]', 'images[0]'],
+                              comfy_api_url='http://comfy_host:8188',
+                              remote=remote,
+                              local_dst_paths=dst_paths))
+    self.assertCountEqual(remote.downloads, [
+        ('http://comfy_host:8188',
+         ComfyUIPathTriplet(type='output', subfolder='sub',
+                            filename='b.png'), dst_paths[0]),
+        ('http://comfy_host:8188',
+         ComfyUIPathTriplet(type='temp', subfolder='',
+                            filename='c.gif'), dst_paths[1]),
+        ('http://comfy_host:8188',
+         ComfyUIPathTriplet(type='output', subfolder='',
+                            filename='a.png'), dst_paths[2]),
+    ])
+
+    # Bad field paths fail before anything is downloaded.
+    remote = _RecordingRemoteFileAPI()
+    with self.assertRaises(Exception):
+      asyncio.run(
+          DownloadPreviewImages(node_ids=['9', '25'],
+                                job_history=job_history,
+                                field_paths=['images[0]', 'images[0]'],
+                                comfy_api_url='http://comfy_host:8188',
+                                remote=remote,
+                                local_dst_paths=dst_paths[:2]))
+    self.assertEqual(remote.downloads, [])
+    with self.assertRaises(ValueError):
+      asyncio.run(
+          DownloadPreviewImages(node_ids=['9'],
+                                job_history=job_history,
+                                field_paths=['images[0]'],
+                                comfy_api_url='http://comfy_host:8188',
+                                remote=remote,
+                                local_dst_paths=dst_paths))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -64,8 +64,9 @@ class WorkflowSubmissionError(CatapultRuntimeError):
   def __init__(self, msg, *, prepared_workflow: dict,
                ticket: APIWorkflowTicket):
     super().__init__(msg)
+    # Copies, so that the error keeps a snapshot of what was submitted.
     self.prepared_workflow: dict = deepcopy(prepared_workflow)
-    self.ticket: APIWorkflowTicket = deepcopy(ticket)
+    self.ticket: APIWorkflowTicket = ticket.model_copy(deep=True)
 
 
 class JobNotFound(CatapultRuntimeError):
@@ -5,8 +5,9 @@
 # under the MIT license or a compatible open source license. See LICENSE.md for
 # the license text.
 
+import asyncio
 from abc import ABC, abstractmethod
-from typing import List, Tuple
+from typing import Sequence, Tuple
 
 from anyio import Path
 
@@ -49,12 +50,80 @@ class RemoteFileAPIBase(ABC):
   async def DownloadFile(self, *, untrusted_src_url: str, dst_path: Path):
     raise NotImplementedError()
 
+  async def DownloadFilesBatch(self,
+                               *,
+                               untrusted_src_urls: Sequence[str],
+                               dst_paths: Sequence[Path],
+                               max_concurrency: int = 16):
+    """Download several files, with up to max_concurrency in flight at once.
+
+    The default implementation issues concurrent DownloadFile() calls.
+    Subclasses can override this if their backend can fetch many files in a
+    cheaper way.
+
+    Args:
+        untrusted_src_urls (Sequence[str]): The URLs to download.
+        dst_paths (Sequence[Path]): Where to save each file, must be the same
+          length as untrusted_src_urls.
+        max_concurrency (int): Maximum number of downloads in flight.
+    """
+    if len(untrusted_src_urls) != len(dst_paths):
+      raise ValueError(f'len(untrusted_src_urls) != len(dst_paths):'
+                       f' {len(untrusted_src_urls)} != {len(dst_paths)}')
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _DownloadOne(src_url: str, dst_path: Path):
+      async with semaphore:
+        await self.DownloadFile(untrusted_src_url=src_url, dst_path=dst_path)
+
+    await asyncio.gather(*(
+        _DownloadOne(src_url, dst_path)
+        for src_url, dst_path in zip(untrusted_src_urls, dst_paths)))
+
   @abstractmethod
   async def DownloadTriplet(self, *, untrusted_comfy_api_url: str,
                             untrusted_src_triplet: ComfyUIPathTriplet,
                             dst_path: Path):
     raise NotImplementedError()
 
+  async def DownloadTripletsBatch(
+      self,
+      *,
+      untrusted_comfy_api_url: str,
+      untrusted_src_triplets: Sequence[ComfyUIPathTriplet],
+      dst_paths: Sequence[Path],
+      max_concurrency: int = 16):
+    """Download several triplets, with up to max_concurrency in flight at once.
+
+    The default implementation issues concurrent DownloadTriplet() calls.
+    Subclasses can override this if their backend can fetch many files in a
+    cheaper way.
+
+    Args:
+        untrusted_comfy_api_url (str): The ComfyUI API server URL.
+        untrusted_src_triplets (Sequence[ComfyUIPathTriplet]): The triplets to
+          download.
+        dst_paths (Sequence[Path]): Where to save each triplet, must be the same
+          length as untrusted_src_triplets.
+        max_concurrency (int): Maximum number of downloads in flight.
+    """
+    if len(untrusted_src_triplets) != len(dst_paths):
+      raise ValueError(
+          f'len(untrusted_src_triplets) != len(dst_paths):'
+          f' {len(untrusted_src_triplets)} != {len(dst_paths)}')
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _DownloadOne(triplet: ComfyUIPathTriplet, dst_path: Path):
+      async with semaphore:
+        await self.DownloadTriplet(
+            untrusted_comfy_api_url=untrusted_comfy_api_url,
+            untrusted_src_triplet=triplet,
+            dst_path=dst_path)
+
+    await asyncio.gather(*(
+        _DownloadOne(triplet, dst_path)
+        for triplet, dst_path in zip(untrusted_src_triplets, dst_paths)))
+
   @abstractmethod
   def TripletToURL(self, *, comfy_api_url: str,
                    triplet: ComfyUIPathTriplet) -> str:
@@ -67,6 +136,17 @@ class RemoteFileAPIBase(ABC):
     raise NotImplementedError()
 
   @abstractmethod
-  def GetBases(self) -> List[str]:
-    """Return a list of base URLs that this API can handle."""
+  def GetBases(self) -> Sequence[str]:
+    """Return the base URLs that this API can handle.
+
+    Callers must not modify the returned sequence.
+    """
     raise NotImplementedError()
+
+  def CanHandle(self, *, url: str) -> bool:
+    """Cheap check if this API might handle the URL, without raising.
+
+    A False lets callers skip this API without paying for a failed attempt. A
+    True is not a promise, the API may still reject the URL with a ValueError.
+    """
+    return True
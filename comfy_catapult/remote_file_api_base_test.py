@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: MIT
+#
+# The Comfy Catapult project requires contributions made to this file be licensed
+# under the MIT license or a compatible open source license. See LICENSE.md for
+# the license text.
+
+import asyncio
+import unittest
+from typing import Dict, List, Sequence, Tuple
+from unittest import IsolatedAsyncioTestCase
+
+from anyio import Path
+
+from .comfy_schema import ComfyUIPathTriplet
+from .remote_file_api_base import RemoteFileAPIBase
+
+
+class _SlowRemoteFileAPI(RemoteFileAPIBase):
+  """Records downloads, and how many were in flight at once."""
+
+  def __init__(self, *, fail_on: Sequence[str] = ()):
+    super().__init__()
+    self._fail_on = set(fail_on)
+    self.in_flight = 0
+    self.max_in_flight = 0
+    # src => dst, for the downloads that finished.
+    self.downloaded: Dict[str, Path] = {}
+
+  async def _Download(self, *, src: str, dst_path: Path):
+    self.in_flight += 1
+    self.max_in_flight = max(self.max_in_flight, self.in_flight)
+    try:
+      # Finish out of order, so that the results can't line up by accident.
+      await asyncio.sleep(0.001 * (len(self.downloaded) % 3))
+      if src in self._fail_on:
+        raise FileNotFoundError(src)
+      self.downloaded[src] = dst_path
+    finally:
+      self.in_flight -= 1
+
+  async def UploadFile(self, *, src_path: Path, untrusted_dst_url: str) -> str:
+    raise NotImplementedError()
+
+  async def DownloadFile(self, *, untrusted_src_url: str, dst_path: Path):
+    await self._Download(src=untrusted_src_url, dst_path=dst_path)
+
+  async def DownloadTriplet(self, *, untrusted_comfy_api_url: str,
+                            untrusted_src_triplet: ComfyUIPathTriplet,
+                            dst_path: Path):
+    await self._Download(src=untrusted_src_triplet.filename, dst_path=dst_path)
+
+  def TripletToURL(self, *, comfy_api_url: str,
+                   triplet: ComfyUIPathTriplet) -> str:
+    raise NotImplementedError()
+
+  def URLToTriplet(self, *, url: str) -> Tuple[str, ComfyUIPathTriplet]:
+    raise NotImplementedError()
+
+  def GetBases(self) -> List[str]:
+    return []
+
+
+class TestRemoteFileApiBase(IsolatedAsyncioTestCase):
+
+  async def test_DownloadFilesBatch(self):
+    remote = _SlowRemoteFileAPI()
+    src_urls = [f'file:///src/{i}.png' for i in range(20)]
+    dst_paths = [Path(f'/dst/{i}.png') for i in range(20)]
+    await remote.DownloadFilesBatch(untrusted_src_urls=src_urls,
+                                    dst_paths=dst_paths,
+                                    max_concurrency=4)
+    self.assertEqual(remote.downloaded, dict(zip(src_urls, dst_paths)))
+    self.assertEqual(remote.max_in_flight, 4)
+
+    remote = _SlowRemoteFileAPI()
+    await remote.DownloadFilesBatch(untrusted_src_urls=src_urls[:3],
+                                    dst_paths=dst_paths[:3])
+    self.assertEqual(remote.max_in_flight, 3)
+
+  async def test_DownloadFilesBatchErrors(self):
+    remote = _SlowRemoteFileAPI(fail_on=['file:///src/5.png'])
+    src_urls = [f'file:///src/{i}.png' for i in range(10)]
+    dst_paths = [Path(f'/dst/{i}.png') for i in range(10)]
+    with self.assertRaises(FileNotFoundError):
+      await remote.DownloadFilesBatch(untrusted_src_urls=src_urls,
+                                      dst_paths=dst_paths,
+                                      max_concurrency=2)
+    self.assertNotIn('file:///src/5.png', remote.downloaded)
+
+    with self.assertRaises(ValueError):
+      await remote.DownloadFilesBatch(untrusted_src_urls=src_urls,
+                                      dst_paths=dst_paths[:-1])
+
+  async def test_DownloadTripletsBatch(self):
+    remote = _SlowRemoteFileAPI()
+    triplets = [
+        ComfyUIPathTriplet(type='output', subfolder='', filename=f'{i}.png')
+        for i in range(20)
+    ]
+    dst_paths = [Path(f'/dst/{i}.png') for i in range(20)]
+    await remote.DownloadTripletsBatch(
+        untrusted_comfy_api_url='http://comfy_host:8188',
+        untrusted_src_triplets=triplets,
+        dst_paths=dst_paths,
+        max_concurrency=5)
+    self.assertEqual(
+        remote.downloaded,
+        {triplet.filename: dst
+         for triplet, dst in zip(triplets, dst_paths)})
+    self.assertEqual(remote.max_in_flight, 5)
+
+  async def test_DownloadTripletsBatchErrors(self):
+    remote = _SlowRemoteFileAPI(fail_on=['3.png'])
+    triplets = [
+        ComfyUIPathTriplet(type='output', subfolder='', filename=f'{i}.png')
+        for i in range(10)
+    ]
+    dst_paths = [Path(f'/dst/{i}.png') for i in range(10)]
+    with self.assertRaises(FileNotFoundError):
+      await remote.DownloadTripletsBatch(
+          untrusted_comfy_api_url='http://comfy_host:8188',
+          untrusted_src_triplets=triplets,
+          dst_paths=dst_paths,
+          max_concurrency=2)
+
+    with self.assertRaises(ValueError):
+      await remote.DownloadTripletsBatch(
+          untrusted_comfy_api_url='http://comfy_host:8188',
+          untrusted_src_triplets=triplets[1:],
+          dst_paths=dst_paths)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -5,15 +5,18 @@
 # under the MIT license or a compatible open source license. See LICENSE.md for
 # the license text.
 
-import json
-from typing import List, Optional, Tuple, cast
-from urllib.parse import ParseResult
+import os
+import re
+import uuid
+from typing import (AbstractSet, FrozenSet, List, Optional, Sequence, Tuple,
+                    cast)
 
+import aiohttp
 from anyio import Path
 from typing_extensions import Literal
 
 from ._internal.url_utils import (VALID_COMFY_API_SCHEMES, SmartURLJoin,
-                                  ToParseResult, ValidateIsBasedURL,
+                                  ToSplitResult, ValidateIsBasedURL,
                                   ValidateIsComfyAPITargetURL)
 from .api_client import ComfyAPIClient
 from .comfy_schema import (VALID_FOLDER_TYPES, APIUploadImageResp,
@@ -22,27 +25,59 @@ from .remote_file_api_base import RemoteFileAPIBase
 
 VALID_COMFY_SCHEME_SCHEMES = ['comfy+http', 'comfy+https']
 
-
-def _ValidateComfyAPITargetURL(url: str, *,
-                               any_api_targets: Optional[List[str]]) -> str:
-  url_pr = ToParseResult(url=url)
-  if url_pr.scheme not in VALID_COMFY_API_SCHEMES:
+# Set versions of the above, for membership tests.
+_VALID_COMFY_API_SCHEMES_SET: FrozenSet[str] = frozenset(
+    VALID_COMFY_API_SCHEMES)
+_VALID_COMFY_SCHEME_SCHEMES_SET: FrozenSet[str] = frozenset(
+    VALID_COMFY_SCHEME_SCHEMES)
+_VALID_FOLDER_TYPES_SET: FrozenSet[str] = frozenset(VALID_FOLDER_TYPES)
+_COMFY_SCHEME_PREFIXES: Tuple[str, ...] = tuple(
+    f'{scheme}://' for scheme in VALID_COMFY_SCHEME_SCHEMES)
+_COMFY_API_URL_PREFIXES: Tuple[str, ...] = tuple(
+    f'{scheme}://' for scheme in VALID_COMFY_API_SCHEMES)
+# Matches the usual comfy+http URLs, which can be split without a full parse.
+# Netlocs and paths with anything urlsplit() would treat specially are left to
+# the slow path.
+_COMFY_SCHEME_URL_RE = re.compile(
+    r"comfy\+(https?)://([A-Za-z0-9._~%!$&'()*+,;=:@-]*)"
+    rf"/({'|'.join(map(re.escape, VALID_FOLDER_TYPES))})(/[^?#\t\r\n]*)?")
+
+# How much downloaded data to accumulate before each write to disk.
+_DOWNLOAD_WRITE_SIZE = 1024 * 1024
+
+# Converting every URL back and forth to check that nothing was lost doubles the
+# cost of each conversion, so it is opt-in.
+_INVERSION_CHECK: bool = os.environ.get('COMFY_CATAPULT_INVERSION_CHECK') == '1'
+
+
+def _ValidateComfyAPITargetURL(
+    url: str, *, any_api_targets: Optional[AbstractSet[str]]) -> str:
+  # The allowed targets are validated when they are registered, so a match is
+  # already known to be good.
+  if any_api_targets is not None and url in any_api_targets:
+    return url
+
+  # Only parse if the cheap prefix check fails, e.g for an upper-case scheme.
+  if (not url.startswith(_COMFY_API_URL_PREFIXES) and ToSplitResult(
+      url=url).scheme not in _VALID_COMFY_API_SCHEMES_SET):
     raise ValueError(
-        f'URL {json.dumps(url)} scheme does not start with one of {VALID_COMFY_API_SCHEMES}'
+        f'URL {repr(url)} scheme does not start with one of {VALID_COMFY_API_SCHEMES}'
     )
 
   if any_api_targets is not None:
     if url not in any_api_targets:
-      raise ValueError(f'URL {json.dumps(url)} is not one of {any_api_targets}')
+      raise ValueError(
+          f'URL {repr(url)} is not one of {sorted(any_api_targets)}')
 
   return url
 
 
-def _ValidateComfySchemeURL(url: str, *, any_bases: Optional[List[str]]) -> str:
-  url_pr = ToParseResult(url=url)
-  if url_pr.scheme not in VALID_COMFY_SCHEME_SCHEMES:
+def _ValidateComfySchemeURL(url: str, *,
+                            any_bases: Optional[Sequence[str]]) -> str:
+  url_pr = ToSplitResult(url=url)
+  if url_pr.scheme not in _VALID_COMFY_SCHEME_SCHEMES_SET:
     raise ValueError(
-        f'URL {json.dumps(url)} scheme does not start with one of {VALID_COMFY_SCHEME_SCHEMES}'
+        f'URL {repr(url)} scheme does not start with one of {VALID_COMFY_SCHEME_SCHEMES}'
     )
 
   # TODO: check the path
@@ -52,34 +87,28 @@ def _ValidateComfySchemeURL(url: str, *, any_bases: Optional[List[str]]) -> str:
   return url
 
 
-def ComfySchemeURLToTriplet(
-    url: str,
-    *,
-    inversion_check: bool = __debug__) -> Tuple[str, ComfyUIPathTriplet]:
-  """Turns a custom URL scheme into a triplet.
-
-  Args:
-    url (str): URL in the form of:
-      comfy+http://comfy-server-host:port/folder_type/subfolder/sub/filename
-  Raises:
-    ValueError: When something is wrong with the URL.
-
-  Returns:
-    Tuple[str, ComfyUIPathTriplet]: The ComfyUI API URL, and the triplet.
-  """
-  url_pr = ToParseResult(url=url)
-  url_path: str = url_pr.path
-
-  if url_pr.scheme not in ['comfy+http', 'comfy+https']:
+def _SplitComfySchemeURL(url: str) -> Tuple[str, str, str, str]:
+  """Returns (comfy_api_url, folder_type, subfolder, filename)."""
+  # Reject other schemes before paying for a parse. Only parse if the cheap
+  # prefix check fails, e.g for an upper-case scheme.
+  if (not url.startswith(_COMFY_SCHEME_PREFIXES) and ToSplitResult(
+      url=url).scheme not in _VALID_COMFY_SCHEME_SCHEMES_SET):
     raise ValueError(
-        f'URL {json.dumps(url)} does not start with one of {VALID_COMFY_SCHEME_SCHEMES}'
+        f'URL {repr(url)} does not start with one of {VALID_COMFY_SCHEME_SCHEMES}'
     )
+  url_pr = ToSplitResult(url=url)
+  url_path: str = url_pr.path
 
   api_scheme = url_pr.scheme[6:]
 
   if not url_path.startswith('/'):
     raise ValueError(
-        f'URL {url}, path {json.dumps(url_path)} must start with a slash')
+        f'URL {repr(url)}, path {repr(url_path)} must start with a slash')
+  # These would otherwise be silently carried over into the API URL; the
+  # inversion check used to be what rejected them.
+  if url_pr.query != '' or url_pr.fragment != '':
+    raise ValueError(
+        f'URL {repr(url)} must not have a query string or fragment')
 
   # /folder_type/subfolder/filename => ('folder_type', 'subfolder', 'filename')
   # /folder_type/filename => ('folder_type', '', 'filename')
@@ -87,45 +116,111 @@ def ComfySchemeURLToTriplet(
   # /folder_type//subfolder/subsubfolder/filename => ('folder_type', '/subfolder/subsubfolder', 'filename')
   # /folder_type/subfolder/subsubfolder//filename => ('folder_type', 'subfolder/subsubfolder/', 'filename')
 
+  # Index into url_path directly rather than slicing and partitioning it.
   folder_type_str: str
-  folder_type_str, _, rest = url_path[1:].partition('/')
-  if folder_type_str not in VALID_FOLDER_TYPES:
+  subfolder: str
+  filename: str
+  first_slash = url_path.find('/', 1)
+  if first_slash == -1:
+    folder_type_str, subfolder, filename = url_path[1:], '', ''
+  else:
+    folder_type_str = url_path[1:first_slash]
+    last_slash = url_path.rfind('/')
+    subfolder = url_path[first_slash + 1:last_slash]
+    filename = url_path[last_slash + 1:]
+  if folder_type_str not in _VALID_FOLDER_TYPES_SET:
     raise ValueError(
-        f'URL {json.dumps(url)} path {json.dumps(url_path)} does not start with one of {VALID_FOLDER_TYPES}'
+        f'URL {repr(url)} path {repr(url_path)} does not start with one of {VALID_FOLDER_TYPES}'
     )
-  folder_type = cast(Literal['input', 'output', 'temp'], folder_type_str)
-  subfolder, _, filename = rest.rpartition('/')
+  # Only the scheme and netloc are left, the query and fragment were checked to
+  # be empty above.
+  comfy_api_url = f'{api_scheme}://{url_pr.netloc}'
+  return comfy_api_url, folder_type_str, subfolder, filename
+
+
+def _HasDotSegment(*, subfolder: str, filename: str) -> bool:
+  if filename in ('.', '..'):
+    return True
+  # Most subfolders have no dots at all, so only split the ones that do.
+  return '.' in subfolder and any(
+      segment in ('.', '..') for segment in subfolder.split('/'))
+
 
-  comfy_api_url_pr = url_pr._replace(scheme=api_scheme, path='')
+def ComfySchemeURLToTriplet(
+    url: str,
+    *,
+    inversion_check: bool = _INVERSION_CHECK) -> Tuple[str, ComfyUIPathTriplet]:
+  """Turns a custom URL scheme into a triplet.
+
+  Args:
+    url (str): URL in the form of:
+      comfy+http://comfy-server-host:port/folder_type/subfolder/sub/filename
+  Raises:
+    ValueError: When something is wrong with the URL.
+
+  Returns:
+    Tuple[str, ComfyUIPathTriplet]: The ComfyUI API URL, and the triplet.
+  """
+  comfy_api_url: str
+  folder_type_str: str
+  subfolder: str
+  filename: str
+  m = _COMFY_SCHEME_URL_RE.fullmatch(url)
+  if m is not None:
+    # Fast path for well-formed URLs.
+    api_scheme, netloc, folder_type_str, rest = m.groups('')
+    comfy_api_url = f'{api_scheme}://{netloc}'
+    last_slash = rest.rfind('/')
+    subfolder = rest[1:last_slash]
+    filename = rest[last_slash + 1:]
+  else:
+    # Anything else goes through the full parse, which either handles it or
+    # raises a descriptive error.
+    comfy_api_url, folder_type_str, subfolder, filename = _SplitComfySchemeURL(
+        url)
+
+  # The triplet validators allow these, but in a URL they would point outside
+  # of the folder the URL names.
+  if _HasDotSegment(subfolder=subfolder, filename=filename):
+    raise ValueError(
+        f'URL {repr(url)} must not have "." or ".." path segments')
 
-  triplet = ComfyUIPathTriplet(type=folder_type,
-                               subfolder=subfolder,
-                               filename=filename)
+  folder_type = cast(Literal['input', 'output', 'temp'], folder_type_str)
+  triplet: ComfyUIPathTriplet
+  if m is not None and filename != '' and not subfolder.startswith('/'):
+    # The regex already checked the folder type, and the filename cannot
+    # contain a slash, so this is everything the validators would check.
+    triplet = ComfyUIPathTriplet.model_construct(type=folder_type,
+                                                 subfolder=subfolder,
+                                                 filename=filename)
+  else:
+    triplet = ComfyUIPathTriplet(type=folder_type,
+                                 subfolder=subfolder,
+                                 filename=filename)
   if inversion_check:
-    inverted_url = TripletToComfySchemeURL(
-        comfy_api_url=comfy_api_url_pr.geturl(),
-        triplet=triplet,
-        inversion_check=False)
+    inverted_url = TripletToComfySchemeURL(comfy_api_url=comfy_api_url,
+                                           triplet=triplet,
+                                           inversion_check=False)
     if inverted_url != url:
       raise ValueError(
-          f'\nurl: {json.dumps(url)}\ntriplet: {repr(triplet)}\ninverted_url: {json.dumps(inverted_url)}'
+          f'\nurl: {repr(url)}\ntriplet: {repr(triplet)}\ninverted_url: {repr(inverted_url)}'
       )
-  return comfy_api_url_pr.geturl(), triplet
+  return comfy_api_url, triplet
 
 
 def TripletToComfySchemeURL(comfy_api_url: str,
                             triplet: ComfyUIPathTriplet,
                             *,
-                            inversion_check: bool = __debug__) -> str:
+                            inversion_check: bool = _INVERSION_CHECK) -> str:
   comfy_api_url = ValidateIsComfyAPITargetURL(comfy_api_url)
-  comfy_api_url_pr = ToParseResult(comfy_api_url)
+  comfy_api_url_pr = ToSplitResult(comfy_api_url)
   api_scheme = comfy_api_url_pr.scheme
   # ComfyUIPathTriplet validation should have already caught this.
   # trunk-ignore(bandit/B101)
-  assert api_scheme in VALID_COMFY_API_SCHEMES
+  assert api_scheme in _VALID_COMFY_API_SCHEMES_SET
   # ComfyUIPathTriplet validation should have already caught this.
   # trunk-ignore(bandit/B101)
-  assert triplet.type in VALID_FOLDER_TYPES
+  assert triplet.type in _VALID_FOLDER_TYPES_SET
   # ComfyUIPathTriplet validation should have already caught this.
   # trunk-ignore(bandit/B101)
   assert '/' not in triplet.filename
@@ -137,22 +232,31 @@ def TripletToComfySchemeURL(comfy_api_url: str,
   assert not triplet.subfolder.startswith('/')
 
   path = triplet.ToLocalPathStr(include_folder_type=True)
-  comfy_scheme = f'comfy+{ToParseResult(comfy_api_url).scheme}'
+  comfy_scheme = f'comfy+{api_scheme}'
   # Sanity check, since api_scheme is in VALID_COMFY_API_SCHEMES, this should
   # always be true.
   # trunk-ignore(bandit/B101)
-  assert comfy_scheme in VALID_COMFY_SCHEME_SCHEMES
-
-  url_pr = comfy_api_url_pr._replace(scheme=comfy_scheme,
-                                     path=SmartURLJoin(comfy_api_url_pr.path,
-                                                       path))
-  url = url_pr.geturl()
+  assert comfy_scheme in _VALID_COMFY_SCHEME_SCHEMES_SET
+
+  url: str
+  if (comfy_api_url_pr.path in ('', '/') and comfy_api_url_pr.query == ''
+      and comfy_api_url_pr.fragment == '' and '?' not in path
+      and '#' not in path):
+    # Common case, a bare http://host:port or http://host:port/ API URL.
+    # Splicing the strings gives the same result as the general case below,
+    # without SmartURLJoin() re-parsing both sides.
+    url = f'{comfy_scheme}://{comfy_api_url_pr.netloc}/{path}'
+  else:
+    url_pr = comfy_api_url_pr._replace(scheme=comfy_scheme,
+                                       path=SmartURLJoin(
+                                           comfy_api_url_pr.path, path))
+    url = url_pr.geturl()
   # if inversion_check:
   #   inverted_triplet = _ComfySchemeURLToTriplet(url=url, inversion_check=False)
   #   assert inverted_triplet.Normalized() == triplet.Normalized(), (
   #       f'\ntriplet:                       {repr(triplet)}'
   #       f'\ntriplet.Normalized():          {repr(triplet.Normalized())}'
-  #       f'\nurl:                           {json.dumps(url)}'
+  #       f'\nurl:                           {repr(url)}'
   #       f'\ninverted_triplet:              {repr(inverted_triplet)}'
   #       f'\ninverted_triplet.Normalized(): {repr(inverted_triplet.Normalized())}'
   #   )
@@ -169,7 +273,11 @@ class ComfySchemeRemoteFileAPI(RemoteFileAPIBase):
   endpoints.
   """
 
-  def __init__(self, *, comfy_api_urls: Optional[List[str]], overwrite: bool):
+  def __init__(self,
+               *,
+               comfy_api_urls: Optional[List[str]],
+               overwrite: bool,
+               session: Optional[aiohttp.ClientSession] = None):
     """Upload and download files from the ComfyUI API directly.
 
     Args:
@@ -180,6 +288,10 @@ class ComfySchemeRemoteFileAPI(RemoteFileAPIBase):
         overwrite (bool): If a file already exists, should it be overwritten? If
           false, the server will rename the file to something else and return
           that file name.
+        session (Optional[aiohttp.ClientSession], optional): A session to use
+          for all the transfers, so that connections to the server are reused.
+          The caller owns it and must close it. If None, each transfer uses its
+          own short-lived session.
     """
     super().__init__()
     self._comfy_api_urls: Optional[List[str]] = None
@@ -190,6 +302,12 @@ class ComfySchemeRemoteFileAPI(RemoteFileAPIBase):
       ]
 
     self._overwrite = overwrite
+    self._session = session
+    # _comfy_api_urls never changes after construction.
+    self._comfy_api_url_set: Optional[FrozenSet[str]] = (
+        None if self._comfy_api_urls is None else frozenset(
+            self._comfy_api_urls))
+    self._bases: Tuple[str, ...] = self._ComputeBases()
 
   def _ToTrustedTriplet(
       self, *,
@@ -197,33 +315,34 @@ class ComfySchemeRemoteFileAPI(RemoteFileAPIBase):
     comfy_api_url, triplet = ComfySchemeURLToTriplet(
         url=untrusted_comfy_scheme_url)
     comfy_api_url = _ValidateComfyAPITargetURL(
-        comfy_api_url, any_api_targets=self._comfy_api_urls)
+        comfy_api_url, any_api_targets=self._comfy_api_url_set)
     return comfy_api_url, triplet
 
   def _ValidateTriplet(
       self, *, untrusted_comfy_api_url: str,
       untrusted_triplet: ComfyUIPathTriplet) -> Tuple[str, ComfyUIPathTriplet]:
     comfy_api_url = _ValidateComfyAPITargetURL(
-        untrusted_comfy_api_url, any_api_targets=self._comfy_api_urls)
+        untrusted_comfy_api_url, any_api_targets=self._comfy_api_url_set)
     triplet = untrusted_triplet
     return comfy_api_url, triplet
 
   async def DownloadFile(self, *, untrusted_src_url: str, dst_path: Path):
     trusted_comfy_api_url, trusted_src_triplet = self._ToTrustedTriplet(
         untrusted_comfy_scheme_url=untrusted_src_url)
-    await self.DownloadTriplet(untrusted_comfy_api_url=trusted_comfy_api_url,
-                               untrusted_src_triplet=trusted_src_triplet,
-                               dst_path=dst_path)
+    await self._DownloadTrustedTriplet(
+        trusted_comfy_api_url=trusted_comfy_api_url,
+        trusted_src_triplet=trusted_src_triplet,
+        dst_path=dst_path)
 
   async def UploadFile(self, *, src_path: Path, untrusted_dst_url: str) -> str:
     # Validate andt turn the URL into the form:
     #   comfy+http://api_host:port/folder_type/subfolder/filename
     trusted_comfy_api_url, trusted_dst_triplet = self._ToTrustedTriplet(
         untrusted_comfy_scheme_url=untrusted_dst_url)
-    new_triplet = await self.UploadToTriplet(
+    new_triplet = await self._UploadToTrustedTriplet(
         src_path=src_path,
-        untrusted_comfy_api_url=trusted_comfy_api_url,
-        untrusted_dst_triplet=trusted_dst_triplet)
+        trusted_comfy_api_url=trusted_comfy_api_url,
+        trusted_dst_triplet=trusted_dst_triplet)
     # Turn the triplet back into the form:
     #   comfy+http://api_host:port/folder_type/subfolder/filename
     return TripletToComfySchemeURL(comfy_api_url=trusted_comfy_api_url,
@@ -235,16 +354,42 @@ class ComfySchemeRemoteFileAPI(RemoteFileAPIBase):
     trusted_comfy_api_url, trusted_src_triplet = self._ValidateTriplet(
         untrusted_comfy_api_url=untrusted_comfy_api_url,
         untrusted_triplet=untrusted_src_triplet)
-
-    async with ComfyAPIClient(comfy_api_url=trusted_comfy_api_url) as client:
-      data: bytes = await client.GetView(
-          folder_type=trusted_src_triplet.type,
-          subfolder=trusted_src_triplet.subfolder,
-          filename=trusted_src_triplet.filename)
-
+    await self._DownloadTrustedTriplet(
+        trusted_comfy_api_url=trusted_comfy_api_url,
+        trusted_src_triplet=trusted_src_triplet,
+        dst_path=dst_path)
+
+  async def _DownloadTrustedTriplet(self, *, trusted_comfy_api_url: str,
+                                    trusted_src_triplet: ComfyUIPathTriplet,
+                                    dst_path: Path):
     await dst_path.parent.mkdir(parents=True, exist_ok=True)
-    async with await dst_path.open('wb') as f:
-      await f.write(data)
+    # Write the file as it arrives, rather than holding all of it in memory. It
+    # goes to a temporary file next to dst_path, which only replaces dst_path
+    # once the whole file arrived, so that a failed download (e.g a 404) leaves
+    # whatever was at dst_path alone.
+    tmp_path = dst_path.with_name(f'.{dst_path.name}.{uuid.uuid4().hex}.part')
+    buffer = bytearray()
+    async with ComfyAPIClient(comfy_api_url=trusted_comfy_api_url,
+                              session=self._session) as client:
+      try:
+        async with await tmp_path.open('wb') as f:
+          async for chunk in client.StreamView(
+              folder_type=trusted_src_triplet.type,
+              subfolder=trusted_src_triplet.subfolder,
+              filename=trusted_src_triplet.filename):
+            # Every write is a round trip to a worker thread, so coalesce the
+            # (often small) network chunks before writing.
+            buffer += chunk
+            if len(buffer) >= _DOWNLOAD_WRITE_SIZE:
+              await f.write(buffer)
+              buffer.clear()
+          if buffer:
+            await f.write(buffer)
+        await tmp_path.replace(dst_path)
+      except BaseException:
+        # Don't leave a truncated file behind.
+        await tmp_path.unlink(missing_ok=True)
+        raise
 
   async def UploadToTriplet(
       self, *, src_path: Path, untrusted_comfy_api_url: str,
@@ -252,24 +397,31 @@ class ComfySchemeRemoteFileAPI(RemoteFileAPIBase):
     trusted_comfy_api_url, trusted_dst_triplet = self._ValidateTriplet(
         untrusted_comfy_api_url=untrusted_comfy_api_url,
         untrusted_triplet=untrusted_dst_triplet)
+    return await self._UploadToTrustedTriplet(
+        src_path=src_path,
+        trusted_comfy_api_url=trusted_comfy_api_url,
+        trusted_dst_triplet=trusted_dst_triplet)
 
+  async def _UploadToTrustedTriplet(
+      self, *, src_path: Path, trusted_comfy_api_url: str,
+      trusted_dst_triplet: ComfyUIPathTriplet) -> ComfyUIPathTriplet:
     async with await src_path.open('rb') as f:
-      data = await f.read()
-
-    async with ComfyAPIClient(comfy_api_url=trusted_comfy_api_url) as client:
-      resp: APIUploadImageResp = await client.PostUploadImage(
-          folder_type=trusted_dst_triplet.type,
-          subfolder=trusted_dst_triplet.subfolder,
-          filename=trusted_dst_triplet.filename,
-          data=data,
-          overwrite=self._overwrite)
-    # If the server renamed the file, we need to update the triplet.
-    return trusted_dst_triplet.model_copy(update={
-        'filename': resp.name,
-        'subfolder': resp.subfolder,
-        'folder_type': resp.type
-    },
-                                          deep=True)
+      async with ComfyAPIClient(comfy_api_url=trusted_comfy_api_url,
+                                session=self._session) as client:
+        # Hand aiohttp the underlying file object, so that it streams the file
+        # from disk instead of us reading all of it into memory first.
+        resp: APIUploadImageResp = await client.PostUploadImage(
+            folder_type=trusted_dst_triplet.type,
+            subfolder=trusted_dst_triplet.subfolder,
+            filename=trusted_dst_triplet.filename,
+            data=f.wrapped,
+            overwrite=self._overwrite)
+    # If the server renamed the file, we need to update the triplet. Every
+    # field comes from the response, so build a new one rather than deep-copying
+    # the old one.
+    return ComfyUIPathTriplet(type=resp.type,
+                              subfolder=resp.subfolder,
+                              filename=resp.name)
 
   def TripletToURL(self, *, comfy_api_url: str,
                    triplet: ComfyUIPathTriplet) -> str:
@@ -278,16 +430,18 @@ class ComfySchemeRemoteFileAPI(RemoteFileAPIBase):
   def URLToTriplet(self, *, url: str) -> Tuple[str, ComfyUIPathTriplet]:
     return ComfySchemeURLToTriplet(url=url)
 
-  def GetBases(self) -> List[str]:
+  def GetBases(self) -> Tuple[str, ...]:
+    return self._bases
+
+  def CanHandle(self, *, url: str) -> bool:
+    # Schemes are case-insensitive.
+    return (url.startswith(_COMFY_SCHEME_PREFIXES)
+            or url[:len('comfy+https://')].lower().startswith(
+                _COMFY_SCHEME_PREFIXES))
+
+  def _ComputeBases(self) -> Tuple[str, ...]:
     if self._comfy_api_urls is None:
-      return [f'comfy+{scheme}://' for scheme in VALID_COMFY_API_SCHEMES]
-
-    return [
-        ParseResult(scheme=f'comfy+{url_pr.scheme}',
-                    netloc=url_pr.netloc,
-                    path='',
-                    params='',
-                    query='',
-                    fragment='').geturl()
-        for url_pr in map(ToParseResult, self._comfy_api_urls)
-    ]
+      return tuple(f'comfy+{scheme}://' for scheme in VALID_COMFY_API_SCHEMES)
+
+    return tuple(f'comfy+{url_pr.scheme}://{url_pr.netloc}'
+                 for url_pr in map(ToSplitResult, self._comfy_api_urls))
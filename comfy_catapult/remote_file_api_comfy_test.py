@@ -5,12 +5,15 @@
 # under the MIT license or a compatible open source license. See LICENSE.md for
 # the license text.
 
+import asyncio
 import os
 import unittest
+import uuid
 from tempfile import TemporaryDirectory
-from typing import List
+from typing import Any, Awaitable, Dict, List, Tuple
 from unittest import IsolatedAsyncioTestCase
 
+import aiohttp
 import pydantic
 from anyio import Path
 
@@ -19,12 +22,29 @@ from .comfy_schema import (VALID_FOLDER_TYPES, ComfyFolderType,
                            ComfyUIPathTriplet)
 from .comfy_schema_test import VALID_SUBFOLDER_EDGES
 from .remote_file_api_comfy import (ComfySchemeRemoteFileAPI,
+                                    ComfySchemeURLToTriplet,
                                     TripletToComfySchemeURL)
 
 COMFY_API_URL = os.environ.get('COMFY_API_URL')
 if COMFY_API_URL is None:
   raise ValueError('Please set COMFY_API_URL in the environment')
 
+# (triplet, expected comfy+ URL path), built once since each triplet is
+# validated by pydantic.
+_TRIPLET_URL_PATHS: List[Tuple[ComfyUIPathTriplet, str]] = [
+    (ComfyUIPathTriplet(type=folder_type,
+                        subfolder=subfolder,
+                        filename='remote-file.txt'),
+     f'{folder_type}/{expected_subfolder}remote-file.txt')
+    for folder_type in VALID_FOLDER_TYPES
+    for subfolder, expected_subfolder in [
+        ('', ''),
+        ('subfolder', 'subfolder/'),
+        ('subfolder/subsubfolder', 'subfolder/subsubfolder/'),
+        ('subfolder/subsubfolder/', 'subfolder/subsubfolder/'),
+    ]
+]
+
 
 class TestRemoteFileApiComfy(IsolatedAsyncioTestCase):
 
@@ -32,76 +52,127 @@ class TestRemoteFileApiComfy(IsolatedAsyncioTestCase):
     if COMFY_API_URL is None:
       raise ValueError('Please set COMFY_API_URL in the environment')
     self._comfy_api_url: str = COMFY_API_URL
+    # One session for all the subtests, so they reuse the same connections.
+    session = aiohttp.ClientSession()
+    self.addAsyncCleanup(session.close)
     self._remote = ComfySchemeRemoteFileAPI(comfy_api_urls=[COMFY_API_URL],
-                                            overwrite=True)
+                                            overwrite=True,
+                                            session=session)
+    tmp_dir = TemporaryDirectory()
+    self.addCleanup(tmp_dir.cleanup)
+    self._tmp_dir = Path(tmp_dir.name)
 
   async def asyncTearDown(self):
     pass
 
+  async def _GatherSubTests(
+      self, cases: List[Tuple[Dict[str, Any], Awaitable[None]]]) -> None:
+    """Runs the cases concurrently, then reports each one as its own subTest.
+
+    Args:
+        cases: (subTest params, coroutine) pairs.
+    """
+    results = await asyncio.gather(*(coro for _, coro in cases),
+                                   return_exceptions=True)
+    for (params, _), result in zip(cases, results):
+      with self.subTest(**params):
+        if isinstance(result, BaseException):
+          raise result
+
   async def _test_UploadFile(self, *, comfy_api_url: str,
-                             triplet: ComfyUIPathTriplet):
-    with TemporaryDirectory() as tmp_dir:
-      path = Path(tmp_dir) / 'local-file.txt'
-      local_download_path = Path(tmp_dir) / 'local-downloaded.txt'
-      contents = 'hello world'
-      await path.write_text(contents)
+                             triplet: ComfyUIPathTriplet, name: str):
+    path = self._tmp_dir / f'{name}-local-file.txt'
+    local_download_path = self._tmp_dir / f'{name}-local-downloaded.txt'
+    contents = 'hello world'
+    await path.write_text(contents)
 
-      input_url = TripletToComfySchemeURL(comfy_api_url=comfy_api_url,
-                                          triplet=triplet)
+    input_url = TripletToComfySchemeURL(comfy_api_url=comfy_api_url,
+                                        triplet=triplet)
 
-      uploaded_url = await self._remote.UploadFile(src_path=path,
-                                                   untrusted_dst_url=input_url)
+    uploaded_url = await self._remote.UploadFile(src_path=path,
+                                                 untrusted_dst_url=input_url)
 
-      await self._remote.DownloadFile(untrusted_src_url=uploaded_url,
-                                      dst_path=local_download_path)
+    await self._remote.DownloadFile(untrusted_src_url=uploaded_url,
+                                    dst_path=local_download_path)
 
-      downloaded_contents = await local_download_path.read_text()
-      self.assertEqual(contents, downloaded_contents)
+    downloaded_contents = await local_download_path.read_text()
+    self.assertEqual(contents, downloaded_contents)
 
   async def test_UploadFile(self):
     folder_type: ComfyFolderType
     folder_types: List[ComfyFolderType] = ['input']
+    cases: List[Tuple[Dict[str, Any], Awaitable[None]]] = []
     for folder_type in folder_types:
-      for subfolder, _ in VALID_SUBFOLDER_EDGES:
-        with self.subTest(folder_type=folder_type, subfolder=subfolder):
-          await self._test_UploadFile(comfy_api_url=self._comfy_api_url,
-                                      triplet=ComfyUIPathTriplet(
-                                          type=folder_type,
-                                          subfolder=subfolder,
-                                          filename='remote-file.txt'))
+      for i, (subfolder, _) in enumerate(VALID_SUBFOLDER_EDGES):
+        # Unique names, so that the concurrent cases don't clobber each other.
+        name = f'{folder_type}-{i}'
+        # Known-valid literals, so skip the validation.
+        triplet = ComfyUIPathTriplet.model_construct(
+            type=folder_type,
+            subfolder=subfolder,
+            filename=f'{name}-remote-file.txt')
+        coro = self._test_UploadFile(comfy_api_url=self._comfy_api_url,
+                                     triplet=triplet,
+                                     name=name)
+        params = {'folder_type': folder_type, 'subfolder': subfolder}
+        cases.append((params, coro))
+    await self._GatherSubTests(cases)
 
   async def _test_UploadToTriplet(self, *, comfy_api_url: str,
-                                  triplet: ComfyUIPathTriplet):
-    with TemporaryDirectory() as tmp_dir:
-      path = Path(tmp_dir) / 'local-file.txt'
-      local_download_path = Path(tmp_dir) / 'local-downloaded.txt'
-      contents = 'hello world'
-      await path.write_text(contents)
+                                  triplet: ComfyUIPathTriplet, name: str):
+    path = self._tmp_dir / f'{name}-local-file.txt'
+    local_download_path = self._tmp_dir / f'{name}-local-downloaded.txt'
+    contents = 'hello world'
+    await path.write_text(contents)
 
-      uploaded_triplet = await self._remote.UploadToTriplet(
-          src_path=path,
-          untrusted_comfy_api_url=comfy_api_url,
-          untrusted_dst_triplet=triplet)
+    uploaded_triplet = await self._remote.UploadToTriplet(
+        src_path=path,
+        untrusted_comfy_api_url=comfy_api_url,
+        untrusted_dst_triplet=triplet)
 
-      await self._remote.DownloadTriplet(untrusted_comfy_api_url=comfy_api_url,
-                                         untrusted_src_triplet=uploaded_triplet,
-                                         dst_path=local_download_path)
+    await self._remote.DownloadTriplet(untrusted_comfy_api_url=comfy_api_url,
+                                       untrusted_src_triplet=uploaded_triplet,
+                                       dst_path=local_download_path)
 
-      downloaded_contents = await local_download_path.read_text()
-      self.assertEqual(contents, downloaded_contents)
+    downloaded_contents = await local_download_path.read_text()
+    self.assertEqual(contents, downloaded_contents)
 
   async def test_UploadToTriplet(self):
     folder_type: ComfyFolderType
     folder_types: List[ComfyFolderType] = ['input']
+    cases: List[Tuple[Dict[str, Any], Awaitable[None]]] = []
     for folder_type in folder_types:
-      for subfolder, _ in VALID_SUBFOLDER_EDGES:
-        with self.subTest(folder_type=folder_type, subfolder=subfolder):
+      for i, (subfolder, _) in enumerate(VALID_SUBFOLDER_EDGES):
+        # Unique names, so that the concurrent cases don't clobber each other.
+        name = f'{folder_type}-{i}'
+        # Known-valid literals, so skip the validation.
+        triplet = ComfyUIPathTriplet.model_construct(
+            type=folder_type,
+            subfolder=subfolder,
+            filename=f'{name}-remote-file.txt')
+        coro = self._test_UploadToTriplet(comfy_api_url=self._comfy_api_url,
+                                          triplet=triplet,
+                                          name=name)
+        params = {'folder_type': folder_type, 'subfolder': subfolder}
+        cases.append((params, coro))
+    await self._GatherSubTests(cases)
 
-          await self._test_UploadToTriplet(comfy_api_url=self._comfy_api_url,
-                                           triplet=ComfyUIPathTriplet(
-                                               type=folder_type,
-                                               subfolder=subfolder,
-                                               filename='remote-file.txt'))
+  async def test_DownloadFileFailureKeepsDst(self):
+    dst_path = self._tmp_dir / 'existing-file.txt'
+    await dst_path.write_text('existing contents')
+    triplet = ComfyUIPathTriplet(type='input',
+                                 subfolder='',
+                                 filename=f'missing-{uuid.uuid4().hex}.txt')
+    src_url = TripletToComfySchemeURL(comfy_api_url=self._comfy_api_url,
+                                      triplet=triplet)
+
+    with self.assertRaises(aiohttp.ClientResponseError):
+      await self._remote.DownloadFile(untrusted_src_url=src_url,
+                                      dst_path=dst_path)
+    # The failed download neither touches dst_path, nor leaves anything behind.
+    self.assertEqual(await dst_path.read_text(), 'existing contents')
+    self.assertEqual([path.name async for path in self._tmp_dir.iterdir()],
+                     ['existing-file.txt'])
 
   async def test__TripletToComfySchemeURL(self):
     comfy_api_url = 'http://comfy_host:23534/'
@@ -147,38 +218,56 @@ class TestRemoteFileApiComfy(IsolatedAsyncioTestCase):
     for comfy_api_url in [
         'http://comfy_host:23534',
     ]:
-      for folder_type in VALID_FOLDER_TYPES:
-        with self.subTest(folder_type=folder_type):
-          self.assertEqual(
-              TripletToComfySchemeURL(comfy_api_url=comfy_api_url,
-                                      triplet=ComfyUIPathTriplet(
-                                          type=folder_type,
-                                          subfolder='',
-                                          filename='remote-file.txt')),
-              f'comfy+{comfy_api_url}/{folder_type}/remote-file.txt')
+      for triplet, expected_path in _TRIPLET_URL_PATHS:
+        with self.subTest(triplet=triplet):
           self.assertEqual(
               TripletToComfySchemeURL(comfy_api_url=comfy_api_url,
-                                      triplet=ComfyUIPathTriplet(
-                                          type=folder_type,
-                                          subfolder='subfolder',
-                                          filename='remote-file.txt')),
-              f'comfy+{comfy_api_url}/{folder_type}/subfolder/remote-file.txt')
-          self.assertEqual(
-              TripletToComfySchemeURL(comfy_api_url=comfy_api_url,
-                                      triplet=ComfyUIPathTriplet(
-                                          type=folder_type,
-                                          subfolder='subfolder/subsubfolder',
-                                          filename='remote-file.txt')),
-              f'comfy+{comfy_api_url}/{folder_type}/subfolder/subsubfolder/remote-file.txt'
-          )
+                                      triplet=triplet),
+              f'comfy+{comfy_api_url}/{expected_path}')
+
+  async def test_ComfySchemeURLToTriplet(self):
+    # The IPv6 host takes the full parse rather than the regex fast path.
+    for host in ['comfy_host:23534', '[::1]:23534']:
+      for triplet, expected_path in _TRIPLET_URL_PATHS:
+        # The URL does not keep a trailing slash on the subfolder.
+        expected_triplet = ComfyUIPathTriplet(
+            type=triplet.type,
+            subfolder=triplet.subfolder.rstrip('/'),
+            filename=triplet.filename)
+        with self.subTest(host=host, triplet=triplet):
           self.assertEqual(
-              TripletToComfySchemeURL(comfy_api_url=comfy_api_url,
-                                      triplet=ComfyUIPathTriplet(
-                                          type=folder_type,
-                                          subfolder='subfolder/subsubfolder/',
-                                          filename='remote-file.txt')),
-              f'comfy+{comfy_api_url}/{folder_type}/subfolder/subsubfolder/remote-file.txt'
-          )
+              ComfySchemeURLToTriplet(f'comfy+http://{host}/{expected_path}'),
+              (f'http://{host}', expected_triplet))
+
+  async def test_ComfySchemeURLToTripletUpperCaseScheme(self):
+    triplet = ComfyUIPathTriplet(type='input',
+                                 subfolder='',
+                                 filename='remote-file.txt')
+    for scheme in ['COMFY+HTTP', 'Comfy+Http']:
+      url = f'{scheme}://comfy_host:23534/input/remote-file.txt'
+      with self.subTest(url=url):
+        self.assertTrue(self._remote.CanHandle(url=url))
+        self.assertEqual(ComfySchemeURLToTriplet(url),
+                         ('http://comfy_host:23534', triplet))
+    self.assertFalse(
+        self._remote.CanHandle(url='http://comfy_host:23534/input/a.png'))
+
+  async def test_ComfySchemeURLToTripletDotSegments(self):
+    for host in ['comfy_host:23534', '[::1]:23534']:
+      for path in [
+          'input/../../etc/passwd',
+          'input/../remote-file.txt',
+          'input/./remote-file.txt',
+          'input/subfolder/../remote-file.txt',
+          'input/subfolder/./subsubfolder/remote-file.txt',
+          'input/subfolder/..',
+          'input/subfolder/.',
+          'input/..',
+      ]:
+        url = f'comfy+http://{host}/{path}'
+        with self.subTest(url=url):
+          with self.assertRaises(ValueError):
+            ComfySchemeURLToTriplet(url)
 
 
 if __name__ == '__main__':
@@ -6,15 +6,20 @@
 # the license text.
 
 import json
-from collections import defaultdict
-from typing import Dict, List, Tuple
+import re
+from typing import Dict, List, Optional, Sequence, Set, Tuple
 
 from anyio import Path
 
-from ._internal.url_utils import IsWeaklyRelativeTo
+from ._internal.url_utils import IsWeaklyRelativeTo, ToSplitResult
+from ._internal.utilities import StatRegularFile
 from .comfy_schema import ComfyUIPathTriplet
 from .remote_file_api_base import RemoteFileAPIBase
 
+# A base that covers a whole ComfyUI server, like the ones from
+# ComfySchemeRemoteFileAPI. Groups: API scheme, netloc.
+_COMFY_SERVER_BASE_RE = re.compile(r'comfy\+(https?)://([^/?#;\t\r\n]+)/?')
+
 
 class GenericRemoteFileAPI(RemoteFileAPIBase):
   """Download or upload files from a URL, using multiple schemss.
@@ -22,38 +27,80 @@ class GenericRemoteFileAPI(RemoteFileAPIBase):
 
   def __init__(self):
     super().__init__()
-    self._base_to_apis: Dict[str, List[RemoteFileAPIBase]] = defaultdict(list)
-
-  def Register(self, api: RemoteFileAPIBase):
+    # (priority, registration order, base, api), one per base of each API.
+    # Sorted from the highest priority to the lowest, and in order of
+    # registration for equal priorities, which is the order APIs are tried in.
+    self._entries: List[Tuple[int, int, str, RemoteFileAPIBase]] = []
+
+  def Register(self, api: RemoteFileAPIBase, *, priority: int = 0):
+    """Register an API to handle its bases.
+
+    Args:
+        api (RemoteFileAPIBase): The API.
+        priority (int, optional): When several APIs can handle a URL, they are
+          tried from the highest priority to the lowest, and in order of
+          registration for equal priorities. Defaults to 0.
+    """
     for base in api.GetBases():
-      self._base_to_apis[base].append(api)
+      self._entries.append((priority, len(self._entries), base, api))
+    self._entries.sort(key=lambda entry: (-entry[0], entry[1]))
 
   def _GetAPIsForURL(self, *, url: str) -> List[RemoteFileAPIBase]:
     apis: List[RemoteFileAPIBase] = []
-    for base, apis in self._base_to_apis.items():
-      if IsWeaklyRelativeTo(base=base, url=url):
-        apis.extend(apis)
+    for _, _, base, api in self._entries:
+      if api in apis or not IsWeaklyRelativeTo(base=base, url=url):
+        continue
+      # Filter with CanHandle() up front, rather than letting each mismatched
+      # API raise on every call.
+      if api.CanHandle(url=url):
+        apis.append(api)
     if apis:
       return apis
     raise ValueError(f'URL {url} is not relative to any of'
-                     f' {self._base_to_apis.keys()}, there is no API registered'
+                     f' {self.GetBases()}, there is no API registered'
                      f' to handle such URLs')
 
   def _GetAPIsForTriplet(
       self, *, comfy_api_url: str,
       triplet: ComfyUIPathTriplet) -> List[RemoteFileAPIBase]:
-    relevant_apis = []
+    comfy_api_url_sr = ToSplitResult(comfy_api_url)
+    server = (comfy_api_url_sr.scheme, comfy_api_url_sr.netloc)
+
+    # The APIs with a base covering this whole server. They can take the
+    # triplet without converting it.
+    server_apis: Set[RemoteFileAPIBase] = set()
+    for _, _, base, api in self._entries:
+      server_match = _COMFY_SERVER_BASE_RE.fullmatch(base)
+      if (server_match is not None
+          and (server_match.group(1), server_match.group(2)) == server):
+        server_apis.add(api)
+
+    relevant_apis: List[RemoteFileAPIBase] = []
+    # api => the triplet converted by that API, or None if it can't.
+    api_to_url: Dict[RemoteFileAPIBase, Optional[str]] = {}
     convered_urls = []
-    for base, base_apis in self._base_to_apis.items():
-      for api in base_apis:
+    for _, _, base, api in self._entries:
+      if api in relevant_apis:
+        continue
+      if api in server_apis:
+        relevant_apis.append(api)
+        continue
+      # Otherwise the API converts the triplet, only once even if it has
+      # several bases, and the URL is compared against this base. It might be
+      # a narrower base on the same server, e.g just its input folder.
+      if api not in api_to_url:
         try:
-          url = api.TripletToURL(comfy_api_url=comfy_api_url, triplet=triplet)
+          api_to_url[api] = api.TripletToURL(comfy_api_url=comfy_api_url,
+                                             triplet=triplet)
         except NotImplementedError:
-          continue
+          api_to_url[api] = None
+      url = api_to_url[api]
+      if url is None:
+        continue
 
-        convered_urls.append({'base': base, 'url': url})
-        if IsWeaklyRelativeTo(base=base, url=url):
-          relevant_apis.append(api)
+      convered_urls.append({'base': base, 'url': url})
+      if IsWeaklyRelativeTo(base=base, url=url):
+        relevant_apis.append(api)
     if relevant_apis:
       return relevant_apis
     raise ValueError(f'ComfyUI API server URL {json.dumps(comfy_api_url)}:'
@@ -62,91 +109,139 @@ class GenericRemoteFileAPI(RemoteFileAPIBase):
                      f'\n convered_urls: {convered_urls}')
 
   async def UploadFile(self, *, src_path: Path, untrusted_dst_url: str) -> str:
-    if not await src_path.exists():
-      raise ValueError(f'File {src_path} does not exist')
-    if not await src_path.is_file():
-      raise ValueError(f'File {src_path} is not a file')
+    await StatRegularFile(src_path)
 
     apis: List[RemoteFileAPIBase] = self._GetAPIsForURL(url=untrusted_dst_url)
-    for i, api in enumerate(apis):
+    last_exc: Optional[ValueError] = None
+    for api in apis:
       try:
         return await api.UploadFile(src_path=src_path,
                                     untrusted_dst_url=untrusted_dst_url)
-      except ValueError:
-        if i + 1 >= len(apis):
-          raise
-    raise AssertionError('unreachable')
+      except ValueError as e:
+        last_exc = e
+    if last_exc is None:
+      raise AssertionError('unreachable')
+    raise last_exc
 
   async def UploadToTriplet(
       self, *, src_path: Path, untrusted_comfy_api_url: str,
       untrusted_dst_triplet: ComfyUIPathTriplet) -> ComfyUIPathTriplet:
-    if not await src_path.exists():
-      raise ValueError(f'File {src_path} does not exist')
-    if not await src_path.is_file():
-      raise ValueError(f'File {src_path} is not a file')
+    await StatRegularFile(src_path)
 
     apis: List[RemoteFileAPIBase] = self._GetAPIsForTriplet(
         comfy_api_url=untrusted_comfy_api_url, triplet=untrusted_dst_triplet)
 
-    for i, api in enumerate(apis):
+    last_exc: Optional[ValueError] = None
+    for api in apis:
       try:
         return await api.UploadToTriplet(
             untrusted_comfy_api_url=untrusted_comfy_api_url,
             src_path=src_path,
             untrusted_dst_triplet=untrusted_dst_triplet)
-      except ValueError:
-        if i + 1 >= len(apis):
-          raise
-    raise AssertionError('unreachable')
+      except ValueError as e:
+        last_exc = e
+    if last_exc is None:
+      raise AssertionError('unreachable')
+    raise last_exc
 
   async def DownloadFile(self, *, untrusted_src_url: str, dst_path: Path):
     apis: List[RemoteFileAPIBase] = self._GetAPIsForURL(url=untrusted_src_url)
-    for i, api in enumerate(apis):
+    last_exc: Optional[ValueError] = None
+    for api in apis:
       try:
         return await api.DownloadFile(untrusted_src_url=untrusted_src_url,
                                       dst_path=dst_path)
-      except ValueError:
-        if i + 1 >= len(apis):
-          raise
-    raise AssertionError('unreachable')
+      except ValueError as e:
+        last_exc = e
+    if last_exc is None:
+      raise AssertionError('unreachable')
+    raise last_exc
+
+  async def DownloadFilesBatch(self,
+                               *,
+                               untrusted_src_urls: Sequence[str],
+                               dst_paths: Sequence[Path],
+                               max_concurrency: int = 16):
+    """Hands the files to the batch download of the API that handles them.
+
+    URLs that only one API can handle are grouped by that API, which can then
+    fetch them in its own cheaper way, e.g LocalRemoteFileAPI copies them in a
+    few worker threads. URLs that several APIs could handle go through
+    DownloadFile() one by one, which falls back from one API to the next. The
+    groups run one after another, so that there are never more than
+    max_concurrency downloads in flight.
+    """
+    if len(untrusted_src_urls) != len(dst_paths):
+      raise ValueError(f'len(untrusted_src_urls) != len(dst_paths):'
+                       f' {len(untrusted_src_urls)} != {len(dst_paths)}')
+    # api => (urls, dst_paths), for the URLs that only that API can handle.
+    api_to_batch: Dict[RemoteFileAPIBase, Tuple[List[str], List[Path]]] = {}
+    other_src_urls: List[str] = []
+    other_dst_paths: List[Path] = []
+    for src_url, dst_path in zip(untrusted_src_urls, dst_paths):
+      apis: List[RemoteFileAPIBase] = self._GetAPIsForURL(url=src_url)
+      if len(apis) == 1:
+        batch_src_urls, batch_dst_paths = api_to_batch.setdefault(
+            apis[0], ([], []))
+        batch_src_urls.append(src_url)
+        batch_dst_paths.append(dst_path)
+      else:
+        other_src_urls.append(src_url)
+        other_dst_paths.append(dst_path)
+
+    for api, (batch_src_urls, batch_dst_paths) in api_to_batch.items():
+      await api.DownloadFilesBatch(untrusted_src_urls=batch_src_urls,
+                                   dst_paths=batch_dst_paths,
+                                   max_concurrency=max_concurrency)
+    if other_src_urls:
+      await super().DownloadFilesBatch(untrusted_src_urls=other_src_urls,
+                                       dst_paths=other_dst_paths,
+                                       max_concurrency=max_concurrency)
 
   async def DownloadTriplet(self, *, untrusted_comfy_api_url: str,
                             untrusted_src_triplet: ComfyUIPathTriplet,
                             dst_path: Path):
     apis: List[RemoteFileAPIBase] = self._GetAPIsForTriplet(
         comfy_api_url=untrusted_comfy_api_url, triplet=untrusted_src_triplet)
-    for i, api in enumerate(apis):
+    last_exc: Optional[ValueError] = None
+    for api in apis:
       try:
         return await api.DownloadTriplet(
             untrusted_comfy_api_url=untrusted_comfy_api_url,
             untrusted_src_triplet=untrusted_src_triplet,
             dst_path=dst_path)
-      except ValueError:
-        if i + 1 >= len(apis):
-          raise
-    raise AssertionError('unreachable')
+      except ValueError as e:
+        last_exc = e
+    if last_exc is None:
+      raise AssertionError('unreachable')
+    raise last_exc
 
   def TripletToURL(self, *, comfy_api_url: str,
                    triplet: ComfyUIPathTriplet) -> str:
     apis: List[RemoteFileAPIBase] = self._GetAPIsForTriplet(
         comfy_api_url=comfy_api_url, triplet=triplet)
-    for i, api in enumerate(apis):
+    last_exc: Optional[ValueError] = None
+    for api in apis:
       try:
         return api.TripletToURL(comfy_api_url=comfy_api_url, triplet=triplet)
-      except ValueError:
-        if i + 1 >= len(apis):
-          raise
-    raise AssertionError('unreachable')
+      except ValueError as e:
+        last_exc = e
+    if last_exc is None:
+      raise AssertionError('unreachable')
+    raise last_exc
 
   def URLToTriplet(self, *, url: str) -> Tuple[str, ComfyUIPathTriplet]:
     apis: List[RemoteFileAPIBase] = self._GetAPIsForURL(url=url)
-    for i, api in enumerate(apis):
+    last_exc: Optional[Exception] = None
+    for api in apis:
       try:
         return api.URLToTriplet(url=url)
-      except (NotImplementedError, ValueError):
-        if i + 1 >= len(apis):
-          raise
-    raise AssertionError('unreachable')
-
-  def GetBases(self) -> List[str]:
-    return list(self._base_to_apis.keys())
+      except (NotImplementedError, ValueError) as e:
+        last_exc = e
+    if last_exc is None:
+      raise AssertionError('unreachable')
+    raise last_exc
+
+  def GetBases(self) -> Tuple[str, ...]:
+    entries = sorted(self._entries, key=lambda entry: entry[1])
+    return tuple(dict.fromkeys(base for _, _, base, _ in entries))
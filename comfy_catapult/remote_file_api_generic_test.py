@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: MIT
+#
+# The Comfy Catapult project requires contributions made to this file be licensed
+# under the MIT license or a compatible open source license. See LICENSE.md for
+# the license text.
+
+import asyncio
+import unittest
+from typing import List, Optional, Sequence, Tuple
+
+from anyio import Path
+
+from .comfy_schema import ComfyUIPathTriplet
+from .remote_file_api_base import RemoteFileAPIBase
+from .remote_file_api_generic import GenericRemoteFileAPI
+
+
+class _FakeRemoteFileAPI(RemoteFileAPIBase):
+  """Only has bases and records downloads, for testing the dispatch of
+  GenericRemoteFileAPI."""
+
+  def __init__(self,
+               *,
+               bases: List[str],
+               can_handle: bool = True,
+               triplet_url: Optional[str] = None):
+    super().__init__()
+    self._bases = bases
+    self._can_handle = can_handle
+    self._triplet_url = triplet_url
+    self.triplet_to_url_calls = 0
+    self.downloads: List[Tuple[str, Path]] = []
+    self.batches: List[Tuple[List[str], List[Path]]] = []
+
+  async def UploadFile(self, *, src_path: Path, untrusted_dst_url: str) -> str:
+    raise NotImplementedError()
+
+  async def DownloadFile(self, *, untrusted_src_url: str, dst_path: Path):
+    self.downloads.append((untrusted_src_url, dst_path))
+
+  async def DownloadFilesBatch(self,
+                               *,
+                               untrusted_src_urls: Sequence[str],
+                               dst_paths: Sequence[Path],
+                               max_concurrency: int = 16):
+    self.batches.append((list(untrusted_src_urls), list(dst_paths)))
+    await super().DownloadFilesBatch(untrusted_src_urls=untrusted_src_urls,
+                                     dst_paths=dst_paths,
+                                     max_concurrency=max_concurrency)
+
+  async def DownloadTriplet(self, *, untrusted_comfy_api_url: str,
+                            untrusted_src_triplet: ComfyUIPathTriplet,
+                            dst_path: Path):
+    raise NotImplementedError()
+
+  def TripletToURL(self, *, comfy_api_url: str,
+                   triplet: ComfyUIPathTriplet) -> str:
+    if self._triplet_url is None:
+      raise NotImplementedError()
+    self.triplet_to_url_calls += 1
+    return self._triplet_url
+
+  def URLToTriplet(self, *, url: str) -> Tuple[str, ComfyUIPathTriplet]:
+    raise NotImplementedError()
+
+  def GetBases(self) -> List[str]:
+    return list(self._bases)
+
+  def CanHandle(self, *, url: str) -> bool:
+    return self._can_handle
+
+
+class TestRemoteFileApiGeneric(unittest.TestCase):
+
+  def test_GetAPIsForURL(self):
+    local = _FakeRemoteFileAPI(bases=['file:///tmp/'])
+    comfy = _FakeRemoteFileAPI(bases=['comfy+http://comfy_host:8188/'])
+    other_local = _FakeRemoteFileAPI(bases=['file:///tmp/'])
+    generic = GenericRemoteFileAPI()
+    generic.Register(local)
+    generic.Register(comfy)
+    generic.Register(other_local)
+
+    # Repeat, so that a lookup that mutates the registry would show up.
+    for _ in range(3):
+      self.assertEqual(generic._GetAPIsForURL(url='file:///tmp/a.txt'),
+                       [local, other_local])
+      self.assertEqual(
+          generic._GetAPIsForURL(url='comfy+http://comfy_host:8188/input/a'),
+          [comfy])
+      with self.assertRaises(ValueError):
+        generic._GetAPIsForURL(url='file:///var/a.txt')
+    self.assertEqual(generic.GetBases(),
+                     ('file:///tmp/', 'comfy+http://comfy_host:8188/'))
+
+  def test_GetAPIsForURLSeveralBases(self):
+    local = _FakeRemoteFileAPI(bases=['file:///tmp/', 'file:///tmp/a/'])
+    other_local = _FakeRemoteFileAPI(bases=['file:///tmp/a/'])
+    generic = GenericRemoteFileAPI()
+    generic.Register(local)
+    generic.Register(other_local)
+
+    # Each API once, even if several of its bases match.
+    self.assertEqual(generic._GetAPIsForURL(url='file:///tmp/a/b.txt'),
+                     [local, other_local])
+
+  def test_GetAPIsForURLPriority(self):
+    low = _FakeRemoteFileAPI(bases=['file:///tmp/'])
+    high = _FakeRemoteFileAPI(bases=['file:///'])
+    unwilling = _FakeRemoteFileAPI(bases=['file:///tmp/'], can_handle=False)
+    generic = GenericRemoteFileAPI()
+    generic.Register(low)
+    generic.Register(unwilling, priority=2)
+    generic.Register(high, priority=1)
+
+    self.assertEqual(generic._GetAPIsForURL(url='file:///tmp/a.txt'),
+                     [high, low])
+    self.assertEqual(generic._GetAPIsForURL(url='file:///var/a.txt'), [high])
+
+  def test_GetAPIsForTriplet(self):
+    comfy = _FakeRemoteFileAPI(
+        bases=[
+            'comfy+http://comfy_host:8188/input/',
+            'comfy+http://comfy_host:8188/output/'
+        ],
+        triplet_url='comfy+http://comfy_host:8188/input/a.png')
+    other = _FakeRemoteFileAPI(
+        bases=['comfy+http://other_host:8188'],
+        triplet_url='comfy+http://comfy_host:8188/input/a.png')
+    local = _FakeRemoteFileAPI(bases=['file:///tmp/'])
+    generic = GenericRemoteFileAPI()
+    generic.Register(local)
+    generic.Register(comfy)
+    generic.Register(other)
+
+    triplet = ComfyUIPathTriplet(type='input', subfolder='', filename='a.png')
+    self.assertEqual(
+        generic._GetAPIsForTriplet(comfy_api_url='http://comfy_host:8188',
+                                   triplet=triplet), [comfy])
+    # Once per API, not once per base.
+    self.assertEqual(comfy.triplet_to_url_calls, 1)
+
+  def test_GetAPIsForTripletServerIndex(self):
+    comfy = _FakeRemoteFileAPI(
+        bases=['comfy+http://comfy_host:8188', 'comfy+https://comfy_host:8188'],
+        triplet_url='comfy+http://comfy_host:8188/input/a.png')
+    local = _FakeRemoteFileAPI(bases=['file:///tmp/'])
+    generic = GenericRemoteFileAPI()
+    generic.Register(local)
+    generic.Register(comfy)
+
+    triplet = ComfyUIPathTriplet(type='input', subfolder='', filename='a.png')
+    for comfy_api_url in ['http://comfy_host:8188', 'https://comfy_host:8188/']:
+      with self.subTest(comfy_api_url=comfy_api_url):
+        self.assertEqual(
+            generic._GetAPIsForTriplet(comfy_api_url=comfy_api_url,
+                                       triplet=triplet), [comfy])
+    # Routed by the server alone, without converting the triplet.
+    self.assertEqual(comfy.triplet_to_url_calls, 0)
+
+  def test_GetAPIsForTripletServerAndNarrowerBases(self):
+    triplet_url = 'comfy+http://comfy_host:8188/input/a.png'
+    server = _FakeRemoteFileAPI(bases=['comfy+http://comfy_host:8188'],
+                                triplet_url=triplet_url)
+    inputs = _FakeRemoteFileAPI(bases=['comfy+http://comfy_host:8188/input/'],
+                                triplet_url=triplet_url)
+    outputs = _FakeRemoteFileAPI(
+        bases=['comfy+http://comfy_host:8188/output/'],
+        triplet_url=triplet_url)
+    local = _FakeRemoteFileAPI(bases=['file:///tmp/'])
+    generic = GenericRemoteFileAPI()
+    generic.Register(inputs)
+    generic.Register(local)
+    generic.Register(server)
+    generic.Register(outputs)
+
+    triplet = ComfyUIPathTriplet(type='input', subfolder='', filename='a.png')
+    # The narrower base still gets its say, in registration order.
+    self.assertEqual(
+        generic._GetAPIsForTriplet(comfy_api_url='http://comfy_host:8188',
+                                   triplet=triplet), [inputs, server])
+    self.assertEqual(server.triplet_to_url_calls, 0)
+    self.assertEqual(inputs.triplet_to_url_calls, 1)
+
+    generic = GenericRemoteFileAPI()
+    generic.Register(inputs)
+    generic.Register(server, priority=1)
+    self.assertEqual(
+        generic._GetAPIsForTriplet(comfy_api_url='http://comfy_host:8188',
+                                   triplet=triplet), [server, inputs])
+
+  def test_DownloadFilesBatch(self):
+    local = _FakeRemoteFileAPI(bases=['file:///tmp/'])
+    comfy = _FakeRemoteFileAPI(bases=['comfy+http://comfy_host:8188/'])
+    shared = _FakeRemoteFileAPI(bases=['file:///tmp/shared/'])
+    generic = GenericRemoteFileAPI()
+    generic.Register(local)
+    generic.Register(comfy)
+    generic.Register(shared)
+
+    src_urls = [
+        'file:///tmp/a.png',
+        'comfy+http://comfy_host:8188/input/b.png',
+        'file:///tmp/shared/c.png',
+        'file:///tmp/d.png',
+    ]
+    dst_paths = [Path(f'/dst/{i}.png') for i in range(len(src_urls))]
+    asyncio.run(
+        generic.DownloadFilesBatch(untrusted_src_urls=src_urls,
+                                   dst_paths=dst_paths))
+
+    # The URLs that only one API handles are forwarded to its batch.
+    self.assertEqual(local.batches, [([src_urls[0], src_urls[3]],
+                                      [dst_paths[0], dst_paths[3]])])
+    self.assertEqual(comfy.batches, [([src_urls[1]], [dst_paths[1]])])
+    self.assertEqual(shared.batches, [])
+    # The shared one goes through DownloadFile(), which tries local first.
+    self.assertEqual(local.downloads, [(src_urls[0], dst_paths[0]),
+                                       (src_urls[3], dst_paths[3]),
+                                       (src_urls[2], dst_paths[2])])
+    self.assertEqual(comfy.downloads, [(src_urls[1], dst_paths[1])])
+    self.assertEqual(shared.downloads, [])
+
+    with self.assertRaises(ValueError):
+      asyncio.run(
+          generic.DownloadFilesBatch(untrusted_src_urls=src_urls,
+                                     dst_paths=dst_paths[1:]))
+    with self.assertRaises(ValueError):
+      asyncio.run(
+          generic.DownloadFilesBatch(untrusted_src_urls=['https://host/a.png'],
+                                     dst_paths=[dst_paths[0]]))
+
+
+if __name__ == '__main__':
+  unittest.main()
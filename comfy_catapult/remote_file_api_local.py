@@ -5,50 +5,131 @@
 # under the MIT license or a compatible open source license. See LICENSE.md for
 # the license text.
 
+import asyncio
+import errno
+import functools
 import json
-from typing import List, Tuple
+import os
+import shutil
+import uuid
+from pathlib import PurePath
+from typing import List, Optional, Sequence, Tuple, Union
 
-import aioshutil
+import anyio.to_thread
 from anyio import Path
 
-from ._internal.url_utils import ToParseResult, ValidateIsBasedURL
+from ._internal.url_utils import ToSplitResult, ValidateIsBasedURL
+from ._internal.utilities import StatRegularFile, StatRegularFileSync
 from .comfy_schema import ComfyUIPathTriplet
 from .remote_file_api_base import RemoteFileAPIBase
 
 
-async def _LocalFileURLToLocalPath(url: str) -> Path:
-  url_pr = ToParseResult(url)
-  if url_pr.scheme != 'file':
+# copy_file_range() errors that just mean "not supported for these files".
+_COPY_FILE_RANGE_UNSUPPORTED = frozenset(
+    (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ETXTBSY))
+
+
+def _CopyFile(src_path: Union[str, os.PathLike],
+              dst_path: Union[str, os.PathLike]):
+  """shutil.copy(), but tries os.copy_file_range() first.
+
+  copy_file_range() lets the kernel do the copy without passing the data
+  through userspace, and can share extents on filesystems with reflinks.
+  shutil.copy() is the fallback when it is unavailable or unsupported.
+  """
+  if hasattr(os, 'copy_file_range'):
+    try:
+      with open(src_path, 'rb') as fsrc, open(dst_path, 'wb') as fdst:
+        while os.copy_file_range(fsrc.fileno(), fdst.fileno(), 1 << 30) > 0:
+          pass
+      shutil.copymode(src_path, dst_path)
+      return
+    except OSError as e:
+      if e.errno not in _COPY_FILE_RANGE_UNSUPPORTED:
+        raise
+  shutil.copy(src_path, dst_path)
+
+
+def _DownloadCopySync(src_path: os.PathLike, dst_path: os.PathLike):
+  """Copies to a temporary file next to dst_path, then moves it into place.
+
+  If the copy fails, dst_path is left as it was, rather than truncated or
+  half-written.
+  """
+  dst_path_str = os.fspath(dst_path)
+  dst_dir, dst_name = os.path.split(dst_path_str)
+  os.makedirs(dst_dir, exist_ok=True)
+  tmp_path = os.path.join(dst_dir, f'.{dst_name}.{uuid.uuid4().hex}.part')
+  try:
+    _CopyFile(src_path, tmp_path)
+    os.replace(tmp_path, dst_path_str)
+  except BaseException:
+    try:
+      os.unlink(tmp_path)
+    except FileNotFoundError:
+      pass
+    raise
+
+
+def _LocalFileURLToPathStr(url: str) -> str:
+  """Validates a local file:// URL, and returns its path, unresolved."""
+  url_sr = ToSplitResult(url)
+  if url_sr.scheme != 'file':
     raise ValueError(f'URL {json.dumps(url)} is not a file:// URL')
-  if url_pr.netloc != '':
+  if url_sr.netloc != '':
     raise ValueError(f'URL {json.dumps(url)} is not a local file URL')
-  if url_pr.params != '':
-    raise ValueError(f'URL {json.dumps(url)} has params')
-  if url_pr.query != '':
+  if url_sr.query != '':
     raise ValueError(f'URL {json.dumps(url)} has query')
-  if url_pr.fragment != '':
+  if url_sr.fragment != '':
     raise ValueError(f'URL {json.dumps(url)} has fragment')
-  if not url_pr.path.startswith('/'):
+  if not url_sr.path.startswith('/'):
     raise ValueError(f'URL {json.dumps(url)} has relative path')
-  path = Path(url_pr.path)
-  path = await path.resolve()
-  if not path.is_absolute():
-    raise ValueError(f'URL {json.dumps(url)} has relative path')
-  return path
+  return url_sr.path
 
 
-async def _IsLocalPathWeaklyRelative(*, base: Path, path: Path) -> bool:
-  base = await base.resolve()
-  path = await path.resolve()
-  return path.is_relative_to(base)
+async def _ValidateLocalPath(*, path: Path, any_bases: Sequence[str]) -> Path:
+  """Returns the resolved path, if it is within any of the bases.
 
+  The path and bases do not need to be resolved beforehand.
+  """
+  # Resolve the path once, and all the bases concurrently, instead of resolving
+  # both for every base in turn.
+  resolved_path, *resolved_bases = await asyncio.gather(
+      path.resolve(), *(Path(base).resolve() for base in any_bases))
+  if _IsUnderAny(resolved_path=resolved_path, resolved_bases=resolved_bases):
+    return resolved_path
+  raise ValueError(f'Path {json.dumps(str(path))} is not relative to any of'
+                   f' {list(any_bases)}')
 
-async def _ValidateLocalPath(*, path: Path, any_bases: List[Path]) -> Path:
-  for base in any_bases:
-    if await _IsLocalPathWeaklyRelative(base=base, path=path):
-      return path
-  raise ValueError(
-      f'Path {json.dumps(str(path))} is not relative to any of {any_bases}')
+
+def _IsUnderAny(*, resolved_path: 'os.PathLike[str]',
+                resolved_bases: Sequence['os.PathLike[str]']) -> bool:
+  # Compare the components as plain tuples; going through anyio.Path builds a
+  # relative path for each base just to throw it away.
+  path_parts = PurePath(resolved_path).parts
+  for resolved_base in resolved_bases:
+    base_parts = PurePath(resolved_base).parts
+    if path_parts[:len(base_parts)] == base_parts:
+      return True
+  return False
+
+
+def _UploadSync(*, src_path: str, dst_path: str,
+                base_paths: Sequence[str]) -> None:
+  """Validates and copies an upload, blocking.
+
+  Runs in a worker thread, so the whole upload costs a single thread trip
+  rather than one per stat, resolve, mkdir and copy.
+  """
+  StatRegularFileSync(src_path)
+  resolved_dst_path = os.path.realpath(dst_path)
+  resolved_bases = [PurePath(os.path.realpath(base)) for base in base_paths]
+  if not _IsUnderAny(resolved_path=PurePath(resolved_dst_path),
+                     resolved_bases=resolved_bases):
+    raise ValueError(f'Path {json.dumps(dst_path)} is not relative to any of'
+                     f' {list(base_paths)}')
+  os.makedirs(os.path.dirname(resolved_dst_path), exist_ok=True)
+  _CopyFile(src_path, resolved_dst_path)
 
 
 class LocalRemoteFileAPI(RemoteFileAPIBase):
@@ -62,54 +143,91 @@ class LocalRemoteFileAPI(RemoteFileAPIBase):
   def __init__(self, *, upload_to_bases: List[str],
                download_from_bases: List[str]):
     super().__init__()
-    self._upload_to_bases = upload_to_bases
-    self._download_from_bases = download_from_bases
+    self._upload_to_bases: Tuple[str, ...] = tuple(upload_to_bases)
+    self._download_from_bases: Tuple[str, ...] = tuple(download_from_bases)
+    self._bases: Tuple[str, ...] = (self._upload_to_bases +
+                                    self._download_from_bases)
+    # The bases above, as (unresolved) local paths. Filled in on first use, so
+    # that each base URL is parsed once rather than on every transfer. They are
+    # resolved on every transfer, along with the path being checked.
+    self._upload_to_base_paths: Optional[List[str]] = None
+    self._download_from_base_paths: Optional[List[str]] = None
+
+  def _GetUploadToBasePaths(self) -> List[str]:
+    if self._upload_to_base_paths is None:
+      self._upload_to_base_paths = [
+          _LocalFileURLToPathStr(url=base) for base in self._upload_to_bases
+      ]
+    return self._upload_to_base_paths
+
+  def _GetDownloadFromBasePaths(self) -> List[str]:
+    if self._download_from_base_paths is None:
+      self._download_from_base_paths = [
+          _LocalFileURLToPathStr(url=base) for base in self._download_from_bases
+      ]
+    return self._download_from_base_paths
 
   async def UploadFile(self, *, src_path: Path, untrusted_dst_url: str) -> str:
     trusted_dst_url: str = ValidateIsBasedURL(url=untrusted_dst_url,
                                               any_bases=self._upload_to_bases)
-    scheme = ToParseResult(trusted_dst_url).scheme
-    if scheme != 'file':
-      raise ValueError(
-          f'URL {json.dumps(trusted_dst_url)} is not a file:// URL')
-    if not await src_path.exists():
-      raise ValueError(f'File {src_path} does not exist')
-    if not await src_path.is_file():
-      raise ValueError(f'File {src_path} is not a file')
-    untrusted_dst_path = await _LocalFileURLToLocalPath(url=trusted_dst_url)
-    trusted_dst_path = await _ValidateLocalPath(
-        path=untrusted_dst_path,
-        any_bases=[
-            await _LocalFileURLToLocalPath(url=base)
-            for base in self._upload_to_bases
-        ])
-
-    await trusted_dst_path.parent.mkdir(parents=True, exist_ok=True)
-    await aioshutil.copy(src_path, trusted_dst_path)
+    # Also rejects non-file:// URLs.
+    untrusted_dst_path = _LocalFileURLToPathStr(url=trusted_dst_url)
+    await anyio.to_thread.run_sync(
+        functools.partial(_UploadSync,
+                          src_path=str(src_path),
+                          dst_path=untrusted_dst_path,
+                          base_paths=self._GetUploadToBasePaths()))
     return trusted_dst_url
 
-  async def DownloadFile(self, *, untrusted_src_url: str, dst_path: Path):
+  async def _ToTrustedSrcPath(self, *, untrusted_src_url: str) -> Path:
     trusted_src_url: str = ValidateIsBasedURL(
         url=untrusted_src_url, any_bases=self._download_from_bases)
-    scheme = ToParseResult(trusted_src_url).scheme
-    if scheme != 'file':
-      raise ValueError(
-          f'URL {json.dumps(trusted_src_url)} is not a file:// URL')
-
-    untrusted_src_path = await _LocalFileURLToLocalPath(url=trusted_src_url)
+    # Also rejects non-file:// URLs.
+    untrusted_src_path = Path(_LocalFileURLToPathStr(url=trusted_src_url))
+    # Returns the resolved path, so there is no need to resolve it beforehand.
     trusted_src_path = await _ValidateLocalPath(
-        path=untrusted_src_path,
-        any_bases=[
-            await _LocalFileURLToLocalPath(url=base)
-            for base in self._download_from_bases
-        ])
-    if not await trusted_src_path.exists():
-      raise ValueError(f'File {trusted_src_path} does not exist')
-    if not await trusted_src_path.is_file():
-      raise ValueError(f'File {trusted_src_path} is not a file')
-
-    await dst_path.parent.mkdir(parents=True, exist_ok=True)
-    await aioshutil.copy(trusted_src_path, dst_path)
+        path=untrusted_src_path, any_bases=self._GetDownloadFromBasePaths())
+    await StatRegularFile(trusted_src_path)
+    return trusted_src_path
+
+  async def DownloadFile(self, *, untrusted_src_url: str, dst_path: Path):
+    trusted_src_path = await self._ToTrustedSrcPath(
+        untrusted_src_url=untrusted_src_url)
+
+    await anyio.to_thread.run_sync(_DownloadCopySync, trusted_src_path,
+                                   dst_path)
+
+  async def DownloadFilesBatch(self,
+                               *,
+                               untrusted_src_urls: Sequence[str],
+                               dst_paths: Sequence[Path],
+                               max_concurrency: int = 16):
+    """Validates every URL, then copies the files in worker threads.
+
+    Up to max_concurrency threads are used, and each one copies its share of
+    the files back to back. This avoids a round trip to the thread pool per
+    file, which dominates when copying many small files. Nothing is copied
+    unless all the URLs are valid.
+    """
+    if len(untrusted_src_urls) != len(dst_paths):
+      raise ValueError(f'len(untrusted_src_urls) != len(dst_paths):'
+                       f' {len(untrusted_src_urls)} != {len(dst_paths)}')
+    if max_concurrency < 1:
+      raise ValueError(f'max_concurrency must be at least 1, got'
+                       f' {max_concurrency}')
+    trusted_src_paths: List[Path] = list(await asyncio.gather(*(
+        self._ToTrustedSrcPath(untrusted_src_url=src_url)
+        for src_url in untrusted_src_urls)))
+    pairs = list(zip(trusted_src_paths, dst_paths))
+
+    def _CopyAll(thread_pairs: List[Tuple[Path, Path]]):
+      for src_path, dst_path in thread_pairs:
+        _DownloadCopySync(src_path, dst_path)
+
+    num_threads = min(max_concurrency, len(pairs))
+    await asyncio.gather(*(
+        anyio.to_thread.run_sync(_CopyAll, pairs[i::num_threads])
+        for i in range(num_threads)))
 
   async def DownloadTriplet(self, *, untrusted_comfy_api_url: str,
                             untrusted_src_triplet: ComfyUIPathTriplet,
@@ -138,5 +256,8 @@ class LocalRemoteFileAPI(RemoteFileAPIBase):
   def URLToTriplet(self, *, url: str) -> Tuple[str, ComfyUIPathTriplet]:
     raise NotImplementedError('Local files do not support triplets')
 
-  def GetBases(self) -> List[str]:
-    return list(self._upload_to_bases + self._download_from_bases)
+  def GetBases(self) -> Tuple[str, ...]:
+    return self._bases
+
+  def CanHandle(self, *, url: str) -> bool:
+    return url.startswith('file://')
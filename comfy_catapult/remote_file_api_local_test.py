@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: MIT
+#
+# The Comfy Catapult project requires contributions made to this file be licensed
+# under the MIT license or a compatible open source license. See LICENSE.md for
+# the license text.
+
+import contextlib
+import errno
+import os
+import stat
+import threading
+import time
+import unittest
+from tempfile import TemporaryDirectory
+from typing import Any, ContextManager, List
+from unittest import IsolatedAsyncioTestCase, mock
+
+from anyio import Path
+
+from . import remote_file_api_local
+from .remote_file_api_local import LocalRemoteFileAPI
+
+
+class TestRemoteFileApiLocal(IsolatedAsyncioTestCase):
+
+  async def asyncSetUp(self):
+    tmp_dir = TemporaryDirectory()
+    self.addCleanup(tmp_dir.cleanup)
+    self._tmp_dir = await Path(tmp_dir.name).resolve()
+    self._src_dir = self._tmp_dir / 'src'
+    self._dst_dir = self._tmp_dir / 'dst'
+    await self._src_dir.mkdir()
+    self._remote = LocalRemoteFileAPI(
+        upload_to_bases=[],
+        download_from_bases=[f'{self._src_dir.as_uri()}/'])
+
+  async def _MakeSrcFiles(self, num_files: int) -> List[str]:
+    src_urls: List[str] = []
+    for i in range(num_files):
+      src_path = self._src_dir / f'file-{i}.txt'
+      await src_path.write_text(f'contents {i}')
+      src_urls.append(src_path.as_uri())
+    return src_urls
+
+  async def _ListDir(self, path: Path) -> List[str]:
+    return sorted([child.name async for child in path.iterdir()])
+
+  async def test_DownloadFile(self):
+    [src_url] = await self._MakeSrcFiles(1)
+    dst_path = self._dst_dir / 'sub' / 'file.txt'
+    await self._remote.DownloadFile(untrusted_src_url=src_url,
+                                    dst_path=dst_path)
+    self.assertEqual(await dst_path.read_text(), 'contents 0')
+    self.assertEqual(await self._ListDir(dst_path.parent), ['file.txt'])
+
+  async def test_DownloadFilesBatch(self):
+    src_urls = await self._MakeSrcFiles(20)
+    # Spread over a few directories, which don't exist yet.
+    dst_paths = [
+        self._dst_dir / f'sub-{i % 3}' / f'dst-{i}.txt'
+        for i in range(len(src_urls))
+    ]
+    await self._remote.DownloadFilesBatch(untrusted_src_urls=src_urls,
+                                          dst_paths=dst_paths,
+                                          max_concurrency=3)
+    for i, dst_path in enumerate(dst_paths):
+      self.assertEqual(await dst_path.read_text(), f'contents {i}')
+
+    await self._remote.DownloadFilesBatch(untrusted_src_urls=[], dst_paths=[])
+    with self.assertRaises(ValueError):
+      await self._remote.DownloadFilesBatch(untrusted_src_urls=src_urls,
+                                            dst_paths=dst_paths[1:])
+    with self.assertRaises(ValueError):
+      await self._remote.DownloadFilesBatch(untrusted_src_urls=src_urls,
+                                            dst_paths=dst_paths,
+                                            max_concurrency=0)
+
+  async def test_DownloadFilesBatchConcurrency(self):
+    src_urls = await self._MakeSrcFiles(20)
+    dst_paths = [self._dst_dir / f'dst-{i}.txt' for i in range(len(src_urls))]
+
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+    download_copy_sync = remote_file_api_local._DownloadCopySync
+
+    def _TrackedDownloadCopySync(src_path, dst_path):
+      nonlocal in_flight, max_in_flight
+      with lock:
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+      try:
+        time.sleep(0.01)
+        download_copy_sync(src_path, dst_path)
+      finally:
+        with lock:
+          in_flight -= 1
+
+    with mock.patch.object(remote_file_api_local, '_DownloadCopySync',
+                           _TrackedDownloadCopySync):
+      await self._remote.DownloadFilesBatch(untrusted_src_urls=src_urls,
+                                            dst_paths=dst_paths,
+                                            max_concurrency=3)
+    self.assertEqual(max_in_flight, 3)
+    for i, dst_path in enumerate(dst_paths):
+      self.assertEqual(await dst_path.read_text(), f'contents {i}')
+
+  async def test_DownloadFilesBatchInvalidURL(self):
+    src_urls = await self._MakeSrcFiles(3)
+    outside_path = self._tmp_dir / 'outside.txt'
+    await outside_path.write_text('outside')
+    missing_url = (self._src_dir / 'missing.txt').as_uri()
+    for bad_url in [outside_path.as_uri(), missing_url]:
+      with self.subTest(bad_url=bad_url):
+        with self.assertRaises((ValueError, FileNotFoundError)):
+          await self._remote.DownloadFilesBatch(
+              untrusted_src_urls=src_urls + [bad_url],
+              dst_paths=[
+                  self._dst_dir / f'dst-{i}.txt'
+                  for i in range(len(src_urls) + 1)
+              ])
+        # All the URLs are validated before anything is copied.
+        self.assertFalse(await self._dst_dir.exists())
+
+  async def test_DownloadFilesBatchFailureKeepsDst(self):
+    src_urls = await self._MakeSrcFiles(2)
+    await self._dst_dir.mkdir()
+    dst_paths = [self._dst_dir / 'dst-0.txt', self._dst_dir / 'dst-1.txt']
+    await dst_paths[1].write_text('existing contents')
+
+    copy_file = remote_file_api_local._CopyFile
+
+    def _FailingCopyFile(src_path, dst_path):
+      if str(src_path).endswith('file-1.txt'):
+        with open(dst_path, 'wb') as f:
+          f.write(b'partial')
+        raise OSError('disk full')
+      copy_file(src_path, dst_path)
+
+    with mock.patch.object(remote_file_api_local, '_CopyFile',
+                           _FailingCopyFile):
+      with self.assertRaises(OSError):
+        await self._remote.DownloadFilesBatch(untrusted_src_urls=src_urls,
+                                              dst_paths=dst_paths,
+                                              max_concurrency=1)
+    self.assertEqual(await dst_paths[0].read_text(), 'contents 0')
+    # The failed copy leaves neither a partial file, nor a temporary one.
+    self.assertEqual(await dst_paths[1].read_text(), 'existing contents')
+    self.assertEqual(await self._ListDir(self._dst_dir),
+                     ['dst-0.txt', 'dst-1.txt'])
+
+  async def test_CopyFile(self):
+    src_path = self._src_dir / 'file.bin'
+    contents = os.urandom(3 * 1024 * 1024 + 7)
+    await src_path.write_bytes(contents)
+    await src_path.chmod(0o640)
+
+    def _UnsupportedCopyFileRange(*args, **kwargs):
+      raise OSError(errno.EXDEV, 'Invalid cross-device link')
+
+    # The second goes through the shutil.copy() fallback.
+    patches: List[ContextManager[Any]] = [
+        contextlib.nullcontext(),
+        mock.patch.object(os,
+                          'copy_file_range',
+                          _UnsupportedCopyFileRange,
+                          create=True),
+    ]
+    for i, patch in enumerate(patches):
+      with self.subTest(i=i):
+        dst_path = self._tmp_dir / f'dst-{i}.bin'
+        with patch:
+          remote_file_api_local._CopyFile(src_path, dst_path)
+        self.assertEqual(await dst_path.read_bytes(), contents)
+        self.assertEqual(stat.S_IMODE((await dst_path.stat()).st_mode),
+                         0o640)
+
+
+if __name__ == '__main__':
+  unittest.main()
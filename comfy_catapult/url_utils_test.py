@@ -31,6 +31,10 @@ class TestUrlUtils(unittest.TestCase):
     self.assertEqual(JoinToBaseURL('http://example.com/path/', '/to'),
                      'http://example.com/path/to')
 
+    self.assertEqual(JoinToBaseURL('file:///', 'path'), 'file:///path')
+    self.assertEqual(JoinToBaseURL('http://example.com/path//', '//to'),
+                     'http://example.com/path///to')
+
 
 if __name__ == '__main__':
   unittest.main(buffer=True)
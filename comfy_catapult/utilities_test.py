@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# SPDX-License-Identifier: MIT
+#
+# The Comfy Catapult project requires contributions made to this file be licensed
+# under the MIT license or a compatible open source license. See LICENSE.md for
+# the license text.
+
+import unittest
+from tempfile import TemporaryDirectory
+from unittest import IsolatedAsyncioTestCase
+
+from anyio import Path
+
+from ._internal.utilities import StatRegularFile
+
+
+class TestUtilities(IsolatedAsyncioTestCase):
+
+  async def test_StatRegularFile(self):
+    with TemporaryDirectory() as tmp_dir_str:
+      tmp_dir = Path(tmp_dir_str)
+      file_path = tmp_dir / 'file.txt'
+      await file_path.write_text('contents')
+
+      st = await StatRegularFile(file_path)
+      self.assertEqual(st.st_size, len('contents'))
+
+      for bad_path in [
+          tmp_dir,
+          tmp_dir / 'missing.txt',
+          file_path / 'not-a-dir.txt',
+      ]:
+        with self.subTest(bad_path=bad_path):
+          with self.assertRaises(ValueError):
+            await StatRegularFile(bad_path)
+
+
+if __name__ == '__main__':
+  unittest.main()
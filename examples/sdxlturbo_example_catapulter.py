@@ -6,15 +6,13 @@
 # the license text.
 
 import asyncio
-import copy
-import json
 import logging
 import sys
 import uuid
 from dataclasses import dataclass
 from datetime import datetime
 from pprint import pprint
-from typing import List
+from typing import FrozenSet, List
 from urllib.parse import urlparse
 
 import yaml
@@ -29,13 +27,29 @@ from comfy_catapult.comfy_schema import (APIHistoryEntry, APINodeID,
                                          APIObjectInfo, APIObjectInputTuple,
                                          APISystemStats, APIWorkflow,
                                          APIWorkflowInConnection)
-from comfy_catapult.comfy_utils import DownloadPreviewImage, GetNodeByTitle
+from comfy_catapult.comfy_utils import (BuildTitleIndex, DownloadPreviewImage,
+                                        GetNodeByTitle)
 from comfy_catapult.remote_file_api_base import RemoteFileAPIBase
 from comfy_catapult.remote_file_api_comfy import ComfySchemeRemoteFileAPI
 from comfy_catapult.remote_file_api_generic import GenericRemoteFileAPI
 from comfy_catapult.remote_file_api_local import LocalRemoteFileAPI
 from examples.utilities.sdxlturbo_parse_args import ParseArgs
 
+try:
+  # orjson parses JSON faster than the json module. Optional; if it is not
+  # installed, pydantic parses the JSON itself.
+  import orjson  # type: ignore[import-not-found]
+except ImportError:
+  orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Slugified once per process; each job only adds a random suffix.
+JOB_ID_PREFIX = f'{slugify(datetime.now().isoformat())}-my-job'
+
+# How many jobs are prepared, run and downloaded at the same time. More jobs
+# than this wait for one of the running jobs to finish.
+MAX_JOBS_IN_FLIGHT = 8
 
 @dataclass
 class ExampleWorkflowInfo:
@@ -46,13 +60,19 @@ class ExampleWorkflowInfo:
   # Something to help with retrieving files from the ComfyUI storage.
   remote: RemoteFileAPIBase
   comfy_api_url: str
-
-  # This should be the workflow json as a dict.
-  workflow_template_dict: dict
-  # This should begin as a deep copy of the template.
-  workflow_dict: dict
+  # The server's /object_info, fetched once for all the jobs. Only needed to
+  # check ckpt_name, so None if it is not overridden.
+  object_info: Optional[APIObjectInfo]
+
+  # This should be the workflow json, parsed into the pydantic model.
+  workflow_template: APIWorkflow
+  # This should begin as a copy of the template.
+  workflow: APIWorkflow
   # This will hold the node ids that we must have results for.
   important: List[APINodeID]
+  # The id of the 'Preview Image' node, found once when preparing the workflow,
+  # and used again to download the results.
+  preview_image_id: Optional[APINodeID]
 
   # Make this any string unique to this job.
   job_id: str
@@ -71,11 +91,14 @@ class ExampleWorkflowInfo:
 
 async def RunExampleWorkflow(*, job_info: ExampleWorkflowInfo):
 
-  # You have to write this function, to change the workflow_dict as you like.
+  # You have to write this function, to change the workflow as you like.
   await PrepareWorkflow(job_info=job_info)
 
   job_id: str = job_info.job_id
-  workflow_dict: dict = job_info.workflow_dict
+  # The workflow is only dumped to a dict here, where it is submitted.
+  workflow_dict: dict = job_info.workflow.model_dump(mode='json',
+                                                      by_alias=True,
+                                                      round_trip=True)
   important: List[APINodeID] = job_info.important
 
   # Here the magic happens, the job is submitted to the ComfyUI server.
@@ -98,6 +121,21 @@ async def RunExampleWorkflow(*, job_info: ExampleWorkflowInfo):
   await DownloadResults(job_info=job_info)
 
 
+async def RunExampleWorkflows(*,
+                              job_infos: List[ExampleWorkflowInfo],
+                              max_in_flight: int = MAX_JOBS_IN_FLIGHT):
+  # Runs the jobs concurrently, so that one job's preparation and downloads
+  # overlap with the others running on the ComfyUI server, while never having
+  # more than max_in_flight jobs going at once.
+  semaphore = asyncio.Semaphore(max_in_flight)
+
+  async def _RunOne(job_info: ExampleWorkflowInfo):
+    async with semaphore:
+      await RunExampleWorkflow(job_info=job_info)
+
+  await asyncio.gather(*(_RunOne(job_info) for job_info in job_infos))
+
+
 async def amain():
   args = await ParseArgs()
 
@@ -108,6 +146,10 @@ async def amain():
          width=120,
          sort_dicts=False)
   logging.basicConfig(level=logging.DEBUG, stream=sys.stderr)
+  # asyncio debug mode instruments every task and callback, so it is only
+  # turned on when asked for.
+  if args.debug:
+    asyncio.get_running_loop().set_debug(True)
 
   # Start a ComfyUI Client (provided in comfy_catapult.api_client).
   async with ComfyAPIClient(comfy_api_url=args.comfy_api_url) as comfy_client:
@@ -137,57 +179,101 @@ async def amain():
                                  args.comfy_temp_file_url
                              ]))
 
-    # Dump the ComfyUI server stats.
+    # Dump the ComfyUI server stats. The dump is only built if it will actually
+    # be logged.
     system_stats: APISystemStats = await comfy_client.GetSystemStats()
-    print('system_stats:', file=sys.stderr)
-    print(yaml.dump(
-        system_stats.model_dump(mode='json', by_alias=True, round_trip=True)),
-          file=sys.stderr)
+    if logger.isEnabledFor(logging.DEBUG):
+      logger.debug(
+          'system_stats:\n%s',
+          yaml.dump(
+              system_stats.model_dump(mode='json',
+                                      by_alias=True,
+                                      round_trip=True)))
 
     async with ComfyCatapult(comfy_client=comfy_client,
                              debug_path=args.debug_path,
                              debug_save_all=True) as catapult:
 
-      dt_str = datetime.now().isoformat()
-
-      # Read the workflow into a string.
-      workflow_template_json_str: str = await args.api_workflow_json_path.read_text(
+      workflow_template_json_bytes: bytes = await args.api_workflow_json_path.read_bytes(
       )
-      workflow_template_dict = json.loads(workflow_template_json_str)
-      workflow_dict = copy.deepcopy(workflow_template_dict)
-
-      job_info = ExampleWorkflowInfo(
-          client=comfy_client,
-          catapult=catapult,
-          remote=remote,
-          workflow_template_dict=workflow_template_dict,
-          workflow_dict=workflow_dict,
-          important=[],
-          job_id=f'{slugify(dt_str)}-my-job-{uuid.uuid4()}',
-          job_history_dict=None,
-          comfy_api_url=args.comfy_api_url,
-          ckpt_name=args.ckpt_name,
-          positive_prompt=args.positive_prompt,
-          negative_prompt=args.negative_prompt,
-          output_path=args.output_path)
-      await RunExampleWorkflow(job_info=job_info)
+      workflow_template = _ParseWorkflow(workflow_template_json_bytes)
+
+      # Get the /object_info, because we sometimes need to correct the model
+      # name, because the model name is inconsistent between windows and linux
+      # if it is in a directory, depending on the ComfyUI's system. E.g
+      # 'sd_xl_turbo_1.0_fp16' vs 'SDXL-TURBO\sd_xl_turbo_1.0_fp16.safetensors'
+      # vs 'SDXL-TURBO/sd_xl_turbo_1.0_fp16.safetensors'.
+      # It is large, and only needed to check a ckpt_name override, so it is
+      # fetched once here, if at all, and shared by all the jobs.
+      object_info: Optional[APIObjectInfo] = None
+      if args.ckpt_name is not None:
+        object_info = await comfy_client.GetObjectInfo()
+
+      # All the jobs go through the same client, catapult and remote, so they
+      # share one connection pool, instead of setting it up again for each job.
+      jobs: List[ExampleWorkflowInfo] = []
+      for job_num in range(args.num_jobs):
+        jobs.append(
+            ExampleWorkflowInfo(
+                client=comfy_client,
+                catapult=catapult,
+                remote=remote,
+                workflow_template=workflow_template,
+                # Parsing the bytes again gives an independent copy, faster
+                # than a deep copy walking the template in Python.
+                workflow=_ParseWorkflow(workflow_template_json_bytes),
+                important=[],
+                preview_image_id=None,
+                job_id=f'{JOB_ID_PREFIX}-{uuid.uuid4().hex}',
+                job_history_dict=None,
+                comfy_api_url=args.comfy_api_url,
+                object_info=object_info,
+                ckpt_name=args.ckpt_name,
+                positive_prompt=args.positive_prompt,
+                negative_prompt=args.negative_prompt,
+                output_path=_JobOutputPath(output_path=args.output_path,
+                                           job_num=job_num,
+                                           num_jobs=args.num_jobs)))
+      await RunExampleWorkflows(job_infos=jobs)
+
+
+def _ParseWorkflow(workflow_json_bytes: bytes) -> APIWorkflow:
+  if orjson is not None:
+    return APIWorkflow.model_validate(orjson.loads(workflow_json_bytes))
+  # Validate straight from JSON with pydantic-core, without building an
+  # intermediate dict.
+  return APIWorkflow.model_validate_json(workflow_json_bytes)
+
+
+def _JobOutputPath(*, output_path: Path, job_num: int, num_jobs: int) -> Path:
+  if num_jobs == 1:
+    return output_path
+  # E.g. output.png => output-0.png, output-1.png, ...
+  return output_path.with_name(
+      f'{output_path.stem}-{job_num}{output_path.suffix}')
 
 
 async def PrepareWorkflow(*, job_info: ExampleWorkflowInfo):
-  # Connect the inputs to `workflow_dict` here.
+  # Connect the inputs to `workflow` here.
 
-  # Use the pydantic model to manipulate the workflow json.
-  workflow = APIWorkflow.model_validate(job_info.workflow_dict)
+  # The pydantic model of the workflow json, modified in place.
+  workflow: APIWorkflow = job_info.workflow
 
   ##############################################################################
   # Get all the nodes we care about, by title.
 
+  # Index the titles once, rather than scanning the workflow for each lookup.
+  title_index = BuildTitleIndex(workflow=workflow)
+
   _, load_checkpoint = GetNodeByTitle(workflow=workflow,
-                                      title='Load Checkpoint')
+                                      title='Load Checkpoint',
+                                      title_index=title_index)
 
   # Unfortunately, two nodes 'CLIP Text Encode (Prompt)' are same title.
   # So instead, we'll find 'SamplerCustom' and work backwards.
-  _, sampler_custom = GetNodeByTitle(workflow=workflow, title='SamplerCustom')
+  _, sampler_custom = GetNodeByTitle(workflow=workflow,
+                                     title='SamplerCustom',
+                                     title_index=title_index)
 
   in_conn = sampler_custom.inputs['positive']
   if not isinstance(in_conn, APIWorkflowInConnection):
@@ -203,17 +289,41 @@ async def PrepareWorkflow(*, job_info: ExampleWorkflowInfo):
   negative_prompt_id = in_conn.output_node_id
   negative_prompt = workflow.root[negative_prompt_id]
 
-  preview_image_id, _ = GetNodeByTitle(workflow=workflow, title='Preview Image')
+  preview_image_id, _ = GetNodeByTitle(workflow=workflow,
+                                       title='Preview Image',
+                                       title_index=title_index)
   ############################################################################
+  # Set some stuff in the workflow api json.
 
-  # Get the /object_info, because we sometimes need to correct the model name,
-  # because the model name is inconsistent between windows and linux if it is in
-  # a directory, depending on the ComfyUI's system. E.g 'sd_xl_turbo_1.0_fp16'
-  # vs 'SDXL-TURBO\sd_xl_turbo_1.0_fp16.safetensors' vs
-  # 'SDXL-TURBO/sd_xl_turbo_1.0_fp16.safetensors'.
-  object_info: APIObjectInfo = await job_info.client.GetObjectInfo()
+  if not ('sd_xl_turbo_1.0_fp16.safetensors'
+          == load_checkpoint.inputs['ckpt_name']):
+    raise ValueError(
+        'sanity check, this is just what is in the workflow already.')
 
-  object_info_entry = object_info.root[load_checkpoint.class_type]
+  if job_info.ckpt_name is not None:
+    if job_info.object_info is None:
+      raise AssertionError('job_info.object_info is None')
+    load_checkpoint_valid_models = _GetValidCheckpointNames(
+        object_info=job_info.object_info,
+        class_type=load_checkpoint.class_type)
+    if job_info.ckpt_name not in load_checkpoint_valid_models:
+      raise ValueError(
+          f'ckpt_name must be one of {sorted(load_checkpoint_valid_models)}, but is {job_info.ckpt_name}'
+      )
+    load_checkpoint.inputs['ckpt_name'] = job_info.ckpt_name
+
+  positive_prompt.inputs['text'] = job_info.positive_prompt
+  negative_prompt.inputs['text'] = job_info.negative_prompt
+  ############################################################################
+  # Mark some nodes as required to be executed, in order for us to consider
+  # the job done.
+  job_info.important = [preview_image_id]
+  job_info.preview_image_id = preview_image_id
+
+
+def _GetValidCheckpointNames(*, object_info: APIObjectInfo,
+                             class_type: str) -> FrozenSet[str]:
+  object_info_entry = object_info.root[class_type]
 
   if not isinstance(object_info_entry.input.required, dict):
     raise ValueError(
@@ -234,53 +344,29 @@ async def PrepareWorkflow(*, job_info: ExampleWorkflowInfo):
         f'Expected chpt_name_entry.type to be list, but got {type(chpt_name_entry.type)}'
     )
 
-  load_checkpoint_valid_models = []
   for item in chpt_name_entry.type:
     if not isinstance(item, str):
       raise ValueError(f'Expected item to be str, but got {type(item)}: {item}')
-    load_checkpoint_valid_models.append(item)
-  ############################################################################
-  # Set some stuff in the workflow api json.
-
-  if not ('sd_xl_turbo_1.0_fp16.safetensors'
-          == load_checkpoint.inputs['ckpt_name']):
-    raise ValueError(
-        'sanity check, this is just what is in the workflow already.')
-
-  if job_info.ckpt_name is not None:
-    if job_info.ckpt_name not in load_checkpoint_valid_models:
-      raise ValueError(
-          f'ckpt_name must be one of {load_checkpoint_valid_models}, but is {job_info.ckpt_name}'
-      )
-    load_checkpoint.inputs['ckpt_name'] = job_info.ckpt_name
-
-  positive_prompt.inputs['text'] = job_info.positive_prompt
-  negative_prompt.inputs['text'] = job_info.negative_prompt
-  ############################################################################
-  # Mark some nodes as required to be executed, in order for us to consider
-  # the job done.
-  job_info.important.append(preview_image_id)
-  ############################################################################
-  # Save our changes to the job_info workflow.
-  job_info.workflow_dict = workflow.model_dump(mode='json',
-                                               by_alias=True,
-                                               round_trip=True)
+  # A set, so that checking the requested ckpt_name is a single lookup.
+  return frozenset(chpt_name_entry.type)
 
 
 async def DownloadResults(*, job_info: ExampleWorkflowInfo):
-  print('job_history:', file=sys.stderr)
   if job_info.job_history_dict is None:
     raise AssertionError('job_info.job_history_dict is None')
+  if job_info.preview_image_id is None:
+    raise AssertionError('job_info.preview_image_id is None')
   job_history = APIHistoryEntry.model_validate(job_info.job_history_dict)
-  workflow = APIWorkflow.model_validate(job_info.workflow_dict)
-  print(yaml.dump(
-      job_history.model_dump(mode='json', by_alias=True, round_trip=True)),
-        file=sys.stderr)
-
-  preview_image_id, _ = GetNodeByTitle(workflow=workflow, title='Preview Image')
+  if logger.isEnabledFor(logging.DEBUG):
+    logger.debug(
+        'job_history:\n%s',
+        yaml.dump(
+            job_history.model_dump(mode='json',
+                                   by_alias=True,
+                                   round_trip=True)))
 
   # You are gonna want to look at how this function works.
-  await DownloadPreviewImage(node_id=preview_image_id,
+  await DownloadPreviewImage(node_id=job_info.preview_image_id,
                              job_history=job_history,
                              field_path='images[0]',
                              comfy_api_url=job_info.comfy_api_url,
@@ -288,4 +374,4 @@ async def DownloadResults(*, job_info: ExampleWorkflowInfo):
                              local_dst_path=Path(job_info.output_path))
 
 
-asyncio.run(amain(), debug=True)
+asyncio.run(amain())
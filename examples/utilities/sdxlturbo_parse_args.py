@@ -65,6 +65,9 @@ class Args(NamedTuple):
   positive_prompt: str
   negative_prompt: str
 
+  num_jobs: int
+  debug: bool
+
 
 async def ParseArgs() -> Args:
 
@@ -122,6 +125,19 @@ async def ParseArgs() -> Args:
   parser.add_argument('--ckpt_name', type=str, default=None)
   parser.add_argument('--positive_prompt', type=str, required=True)
   parser.add_argument('--negative_prompt', type=str, required=True)
+  parser.add_argument(
+      '--num_jobs',
+      type=int,
+      default=1,
+      help='Number of jobs to run concurrently, through the same client and'
+      ' catapult. With more than one job, each output is suffixed with the job'
+      ' number.')
+  parser.add_argument(
+      '--debug',
+      action='store_true',
+      help='Run the event loop in asyncio debug mode. This helps find slow'
+      ' callbacks and never-awaited coroutines, but adds overhead to every'
+      ' task and callback.')
 
   args = parser.parse_args()
 
@@ -149,31 +165,24 @@ async def ParseArgs() -> Args:
   ##############################################################################
   api_workflow_json_path: Path = args.api_workflow_json_path
   ##############################################################################
+  # Only the string form of these URLs is needed from here on, so turn each
+  # into a string once, and don't parse them again.
   comfy_install_file_url_pr: Optional[ParseResult] = args.comfy_install_file_url
-
-  comfy_input_file_url_pr: Optional[ParseResult] = args.comfy_input_file_url
-  comfy_output_file_url_pr: Optional[ParseResult] = args.comfy_output_file_url
-  comfy_temp_file_url_pr: Optional[ParseResult] = args.comfy_temp_file_url
-  if (comfy_install_file_url_pr is None
-      or comfy_install_file_url_pr.geturl() == ''):
-    comfy_install_file_url_pr = urlparse(ValidateIsURLDirectory(url='file:///'))
-  comfy_api_url_pr = urlparse(
-      ValidateIsURLDirectory(url=comfy_install_file_url_pr.geturl()))
-
-  if comfy_input_file_url_pr is None:
-    comfy_input_file_url_pr = urlparse(
-        SmartURLJoin(comfy_install_file_url_pr.geturl(), 'input/'))
-  if comfy_output_file_url_pr is None:
-    comfy_output_file_url_pr = urlparse(
-        SmartURLJoin(comfy_install_file_url_pr.geturl(), 'output/'))
-  if comfy_temp_file_url_pr is None:
-    comfy_temp_file_url_pr = urlparse(
-        SmartURLJoin(comfy_install_file_url_pr.geturl(), 'temp/'))
-
-  comfy_install_file_url = comfy_install_file_url_pr.geturl()
-  comfy_input_file_url = comfy_input_file_url_pr.geturl()
-  comfy_output_file_url = comfy_output_file_url_pr.geturl()
-  comfy_temp_file_url = comfy_temp_file_url_pr.geturl()
+  comfy_install_file_url: str = ''
+  if comfy_install_file_url_pr is not None:
+    comfy_install_file_url = comfy_install_file_url_pr.geturl()
+  if comfy_install_file_url == '':
+    comfy_install_file_url = 'file:///'
+  comfy_install_file_url = ValidateIsURLDirectory(url=comfy_install_file_url)
+
+  def _URLOrDefault(url_pr: Optional[ParseResult], default_subdir: str) -> str:
+    if url_pr is None:
+      return SmartURLJoin(comfy_install_file_url, default_subdir)
+    return url_pr.geturl()
+
+  comfy_input_file_url = _URLOrDefault(args.comfy_input_file_url, 'input/')
+  comfy_output_file_url = _URLOrDefault(args.comfy_output_file_url, 'output/')
+  comfy_temp_file_url = _URLOrDefault(args.comfy_temp_file_url, 'temp/')
   ##############################################################################
   tmp_path: Path = args.tmp_path
   ##############################################################################
@@ -182,6 +191,13 @@ async def ParseArgs() -> Args:
   debug_path: Optional[Path] = args.debug_path
   if debug_path is None:
     debug_path = tmp_path / 'debug'
+  ##############################################################################
+  num_jobs: int = args.num_jobs
+  if num_jobs < 1:
+    parser.print_usage(file=sys.stderr)
+    print(f'Error: argument --num_jobs must be at least 1, but is {num_jobs}',
+          file=sys.stderr)
+    sys.exit(1)
 
   return Args(
       comfy_api_url=comfy_api_url,
@@ -196,4 +212,6 @@ async def ParseArgs() -> Args:
       ckpt_name=args.ckpt_name,
       positive_prompt=args.positive_prompt,
       negative_prompt=args.negative_prompt,
+      num_jobs=num_jobs,
+      debug=args.debug,
   )
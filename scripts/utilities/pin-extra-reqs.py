@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 import argparse
+import re
 from pathlib import Path
-from typing import List, Tuple
+from typing import List
 
 # tomlkit is used, so that everything is preserved, e.g comments etc.
 import tomlkit
@@ -11,6 +12,15 @@ from tomlkit.toml_document import TOMLDocument
 
 _VALID_EXTRA_NAMES = ['dev', 'prod']
 
+# A line continuation (backslash, line break and indentation), followed by an
+# option line such as pip-compile's `--hash=...`, or a comment. Neither is part
+# of the requirement, so they are dropped, keeping their own continuation, if
+# any.
+_OPTION_CONTINUATION_RE = re.compile(
+    r'[ \t]*\\[ \t]*\n[ \t]*(?:--|#)[^\n]*?(?=[ \t]*\\?[ \t]*(?:\n|\Z))')
+# Any other line continuation, which joins the two lines.
+_CONTINUATION_RE = re.compile(r'[ \t]*\\[ \t]*\n[ \t]*')
+
 _DESCRIPTION = f"""
 Pin the {{{",".join(_VALID_EXTRA_NAMES)}}} requirements in pyproject.toml.
 
@@ -42,32 +52,17 @@ requirements_path: Path = args.reqs
 extra_name: str = args.extra
 
 pyproject_data: TOMLDocument = tomlkit.loads(pyproject_path.read_text())
-lines = requirements_path.read_text().splitlines()
-
-
-def _StripContinuation(line) -> Tuple[bool, str]:
-  line = line.strip()
-  if line.endswith('\\'):
-    return (True, line[:-1].strip())
-  return (False, line)
-
 
-existing_dependencies: List[str] = []
-is_continuation = False
-for i in range(len(lines)):
-  line = lines[i]
-  append_to_last = is_continuation
-  is_continuation, stripped_line = _StripContinuation(line)
-  if not stripped_line:
-    continue
-  if stripped_line.startswith('#'):
-    continue
-  if stripped_line.startswith('--'):
-    continue
-  if append_to_last:
-    existing_dependencies[-1] += stripped_line
-  else:
-    existing_dependencies.append(stripped_line)
+# The continuations are resolved by the regex engine over the whole text, which
+# leaves one requirement, comment or option per line.
+requirements_text = _CONTINUATION_RE.sub(
+    '', _OPTION_CONTINUATION_RE.sub('', requirements_path.read_text()))
+stripped_lines = map(str.strip, requirements_text.splitlines())
+existing_dependencies: List[str] = [
+    line for line in (line[:-1].rstrip() if line[-1:] == '\\' else line
+                      for line in stripped_lines)
+    if line and not line.startswith(('#', '--'))
+]
 
 if 'project' not in pyproject_data:
   raise ValueError('Invalid pyproject.toml file, missing "project" section.')
@@ -96,19 +91,19 @@ if not isinstance(toml_extra_dependencies, tomlkit.items.Array):
   raise ValueError(
       f'Invalid pyproject.toml file, expected "project.optional-dependencies.{extra_name}" to be an array. Got {type(toml_extra_dependencies)}.'
   )
-if sorted(list(toml_extra_dependencies)) == sorted(existing_dependencies):
+# Decide before touching the document, so that the common "nothing changed"
+# case never has to dump the whole pyproject.toml.
+if sorted(map(str, toml_extra_dependencies)) == sorted(existing_dependencies):
   print('No changes detected')
   exit(0)
 
-toml_extra_dependencies.clear()
-for dep in existing_dependencies:
-  toml_extra_dependencies.append(dep)
-opt_deps[extra_name] = toml_extra_dependencies.multiline(True)
+# Build the replacement array in one go, rather than clearing the existing one
+# and splicing the dependencies back in one append() at a time.
+new_extra_dependencies = tomlkit.item(existing_dependencies)
+assert isinstance(new_extra_dependencies, tomlkit.items.Array)
+opt_deps[extra_name] = new_extra_dependencies.multiline(True)
 
+# The dependencies differ, so the output differs from what is on disk.
 output = tomlkit.dumps(pyproject_data)
-if output == pyproject_path.read_text():
-  print('No changes detected')
-  exit(0)
-
 # Write the updated pyproject.toml back to disk
-pyproject_path.write_text(tomlkit.dumps(pyproject_data))
+pyproject_path.write_text(output)